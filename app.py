@@ -5,7 +5,12 @@ import uuid
 import hashlib
 import hmac
 import base64
+import bisect
+import threading
 import requests as http_requests
+import click
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone, timedelta
 
 def tw_now():
@@ -14,7 +19,7 @@ def tw_now():
 from flask import Flask, request, jsonify, send_from_directory, session
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from sqlalchemy import func
+from sqlalchemy import func, case, event as sa_event
 from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
@@ -46,6 +51,8 @@ LINE_CHANNEL_ACCESS_TOKEN = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN', '')
 LINE_CHANNEL_SECRET       = os.environ.get('LINE_CHANNEL_SECRET', '')
 LINE_PUSH_URL  = 'https://api.line.me/v2/bot/message/push'
 LINE_REPLY_URL = 'https://api.line.me/v2/bot/message/reply'
+LINE_MULTICAST_URL = 'https://api.line.me/v2/bot/message/multicast'
+LINE_MULTICAST_MAX = 500   # LINE multicast 每次最多 500 位收件者
 SITE_URL       = os.environ.get('SITE_URL', 'https://seat-booking-rlf2.onrender.com')
 LIFF_URL       = os.environ.get('LIFF_URL', 'https://liff.line.me/2009193434-BpOSKuw9')
 LIFF_ID        = os.environ.get('LIFF_ID', '')
@@ -79,6 +86,51 @@ CLOUDINARY_API_SECRET = os.environ.get('CLOUDINARY_API_SECRET', '')
 USE_CLOUDINARY = all([CLOUDINARY_CLOUD_NAME, CLOUDINARY_API_KEY, CLOUDINARY_API_SECRET])
 
 
+# ─────────────────────────────────────────────
+# HTTP Client（外部服務共用連線池）
+# ─────────────────────────────────────────────
+# LINE / Gmail / SendGrid / Twilio / Cloudinary 等外部呼叫共用 requests.Session，
+# 每個 host 一個 Session（keep-alive + 連線池），避免每則訊息都重新 TCP+TLS 握手。
+# 只對連線失敗自動重試；POST 已送出後的錯誤交由呼叫端（通知 outbox）決定是否重送。
+
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '10'))
+HTTP_RETRIES   = int(os.environ.get('HTTP_RETRIES', '2'))
+
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+
+
+def http_session(url: str) -> http_requests.Session:
+    """取得 url 所屬 host 的共用 Session"""
+    from urllib.parse import urlsplit
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    host = urlsplit(url).netloc
+    sess = _http_sessions.get(host)
+    if sess is None:
+        with _http_sessions_lock:
+            sess = _http_sessions.get(host)
+            if sess is None:
+                retry = Retry(total=HTTP_RETRIES, connect=HTTP_RETRIES,
+                              read=0, status=0, backoff_factor=0.3)
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=HTTP_POOL_SIZE,
+                                      max_retries=retry)
+                sess = http_requests.Session()
+                sess.mount('https://', adapter)
+                sess.mount('http://', adapter)
+                _http_sessions[host] = sess
+    return sess
+
+
+def http_post(url: str, **kwargs):
+    return http_session(url).post(url, **kwargs)
+
+
+def http_get(url: str, **kwargs):
+    return http_session(url).get(url, **kwargs)
+
+
 # ─────────────────────────────────────────────
 # LINE Helpers
 # ─────────────────────────────────────────────
@@ -95,26 +147,50 @@ def verify_line_signature(body: bytes, signature: str) -> bool:
     return hmac.compare_digest(base64.b64encode(digest).decode(), signature)
 
 
-def push_line(user_id: str, messages: list):
+def push_line(user_id: str, messages: list) -> bool:
+    """推播訊息；回傳 False 表示送出失敗（可重試）"""
     if not LINE_CHANNEL_ACCESS_TOKEN or not user_id:
-        return
+        return True
     try:
-        http_requests.post(LINE_PUSH_URL,
-                           headers=_line_headers(),
-                           json={'to': user_id, 'messages': messages},
-                           timeout=10)
+        resp = http_post(LINE_PUSH_URL,
+                         headers=_line_headers(),
+                         json={'to': user_id, 'messages': messages},
+                         timeout=10)
+        if resp.status_code >= 400:
+            print(f'[LINE push error] {resp.status_code}: {resp.text[:300]}')
+            return False
+        return True
     except Exception as e:
         print(f'[LINE push error] {e}')
+        return False
+
+
+def multicast_line(user_ids: list, messages: list):
+    """一次推播給多位使用者（最多 LINE_MULTICAST_MAX 位）；回傳 (成功與否, 錯誤訊息)"""
+    if not LINE_CHANNEL_ACCESS_TOKEN or not user_ids:
+        return True, ''
+    try:
+        resp = http_post(LINE_MULTICAST_URL,
+                         headers=_line_headers(),
+                         json={'to': list(user_ids), 'messages': messages},
+                         timeout=15)
+        if resp.status_code >= 400:
+            print(f'[LINE multicast error] {resp.status_code}: {resp.text[:300]}')
+            return False, f'{resp.status_code}: {resp.text[:200]}'
+        return True, ''
+    except Exception as e:
+        print(f'[LINE multicast error] {e}')
+        return False, str(e)[:200]
 
 
 def reply_line(reply_token: str, messages: list):
     if not LINE_CHANNEL_ACCESS_TOKEN or not reply_token:
         return
     try:
-        http_requests.post(LINE_REPLY_URL,
-                           headers=_line_headers(),
-                           json={'replyToken': reply_token, 'messages': messages},
-                           timeout=10)
+        http_post(LINE_REPLY_URL,
+                  headers=_line_headers(),
+                  json={'replyToken': reply_token, 'messages': messages},
+                  timeout=10)
     except Exception as e:
         print(f'[LINE reply error] {e}')
 
@@ -122,28 +198,34 @@ def reply_line(reply_token: str, messages: list):
 # Gmail + SMS Helpers
 # ─────────────────────────────────────────────
 
-def send_email(to_addr: str, subject: str, body_html: str):
-    """寄送 HTML 信件：Gmail API > SendGrid > Gmail SMTP"""
+def send_email(to_addr: str, subject: str, body_html: str) -> bool:
+    """寄送 HTML 信件：Gmail API > SendGrid > Gmail SMTP；回傳 False 表示寄送失敗"""
     if not to_addr:
-        return
+        return True
     if USE_GMAIL_API:
-        _send_via_gmail_api(to_addr, subject, body_html)
+        return _send_via_gmail_api(to_addr, subject, body_html)
     elif USE_SENDGRID:
-        _send_via_sendgrid(to_addr, subject, body_html)
+        return _send_via_sendgrid(to_addr, subject, body_html)
     elif USE_GMAIL:
-        _send_via_gmail(to_addr, subject, body_html)
-    else:
-        print('[Email] 未設定任何 Email 服務，略過寄信')
+        return _send_via_gmail(to_addr, subject, body_html)
+    print('[Email] 未設定任何 Email 服務，略過寄信')
+    return True
 
 
-def _send_via_gmail_api(to_addr: str, subject: str, body_html: str):
-    """透過 Gmail API（OAuth2 Refresh Token）寄信 — 100% 不進垃圾桶"""
-    import base64
-    from email.mime.multipart import MIMEMultipart
-    from email.mime.text import MIMEText
-    try:
-        # Step 1: 用 refresh token 換 access token
-        token_resp = http_requests.post(
+# Gmail access token 快取：有效期內重複使用，到期前 60 秒或遇到 401 才重新換發
+_gmail_token = {'access_token': '', 'expires_at': 0.0}
+_gmail_token_lock = threading.Lock()
+
+
+def _gmail_access_token(force_refresh: bool = False) -> str:
+    """取得 Gmail API access token（執行緒安全）；失敗回傳空字串"""
+    import time
+    with _gmail_token_lock:
+        if (not force_refresh and _gmail_token['access_token']
+                and time.time() < _gmail_token['expires_at'] - 60):
+            return _gmail_token['access_token']
+        # 用 refresh token 換 access token
+        token_resp = http_post(
             'https://oauth2.googleapis.com/token',
             data={
                 'client_id':     GOOGLE_CLIENT_ID,
@@ -157,7 +239,23 @@ def _send_via_gmail_api(to_addr: str, subject: str, body_html: str):
         access_token = token_data.get('access_token')
         if not access_token:
             print(f'[Gmail API] 取得 access token 失敗：{token_data}')
-            return
+            _gmail_token.update(access_token='', expires_at=0.0)
+            return ''
+        _gmail_token.update(access_token=access_token,
+                            expires_at=time.time() + int(token_data.get('expires_in', 3600)))
+        return access_token
+
+
+def _send_via_gmail_api(to_addr: str, subject: str, body_html: str):
+    """透過 Gmail API（OAuth2 Refresh Token）寄信 — 100% 不進垃圾桶"""
+    import base64
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    try:
+        # Step 1: 取得（快取的）access token
+        access_token = _gmail_access_token()
+        if not access_token:
+            return False
 
         # Step 2: 組裝 MIME 郵件
         from_addr = MAIL_FROM or GMAIL_USER
@@ -168,22 +266,30 @@ def _send_via_gmail_api(to_addr: str, subject: str, body_html: str):
         msg.attach(MIMEText(body_html, 'html', 'utf-8'))
         raw = base64.urlsafe_b64encode(msg.as_bytes()).decode('utf-8')
 
-        # Step 3: 透過 Gmail API 發送
-        resp = http_requests.post(
-            'https://gmail.googleapis.com/gmail/v1/users/me/messages/send',
-            headers={
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type':  'application/json',
-            },
-            json={'raw': raw},
-            timeout=15
-        )
+        # Step 3: 透過 Gmail API 發送（token 失效回 401 時換發一次再送）
+        for attempt in range(2):
+            resp = http_post(
+                'https://gmail.googleapis.com/gmail/v1/users/me/messages/send',
+                headers={
+                    'Authorization': f'Bearer {access_token}',
+                    'Content-Type':  'application/json',
+                },
+                json={'raw': raw},
+                timeout=15
+            )
+            if resp.status_code != 401 or attempt:
+                break
+            access_token = _gmail_access_token(force_refresh=True)
+            if not access_token:
+                return False
         if resp.status_code == 200:
             print(f'[Gmail API] sent to {to_addr}')
-        else:
-            print(f'[Gmail API error] {resp.status_code}: {resp.text[:300]}')
+            return True
+        print(f'[Gmail API error] {resp.status_code}: {resp.text[:300]}')
+        return False
     except Exception as e:
         print(f'[Gmail API error] {e}')
+        return False
 
 
 def _send_via_sendgrid(to_addr: str, subject: str, body_html: str):
@@ -196,7 +302,7 @@ def _send_via_sendgrid(to_addr: str, subject: str, body_html: str):
         'content': [{'type': 'text/html', 'value': body_html}],
     }
     try:
-        resp = http_requests.post(
+        resp = http_post(
             'https://api.sendgrid.com/v3/mail/send',
             headers={
                 'Authorization': f'Bearer {SENDGRID_API_KEY}',
@@ -207,15 +313,17 @@ def _send_via_sendgrid(to_addr: str, subject: str, body_html: str):
         )
         if resp.status_code in (200, 202):
             print(f'[SendGrid] sent to {to_addr}')
-        else:
-            print(f'[SendGrid error] {resp.status_code}: {resp.text[:500]}')
-            # 403 = sender not verified; 401 = wrong API key
-            if resp.status_code == 403:
-                print('[SendGrid] ★ 寄件人未驗證！請至 SendGrid → Settings → Sender Authentication 驗證寄件人')
-            elif resp.status_code == 401:
-                print('[SendGrid] ★ API Key 錯誤，請確認 SENDGRID_API_KEY 環境變數')
+            return True
+        print(f'[SendGrid error] {resp.status_code}: {resp.text[:500]}')
+        # 403 = sender not verified; 401 = wrong API key
+        if resp.status_code == 403:
+            print('[SendGrid] ★ 寄件人未驗證！請至 SendGrid → Settings → Sender Authentication 驗證寄件人')
+        elif resp.status_code == 401:
+            print('[SendGrid] ★ API Key 錯誤，請確認 SENDGRID_API_KEY 環境變數')
+        return False
     except Exception as e:
         print(f'[SendGrid error] {e}')
+        return False
 
 
 def _send_via_gmail(to_addr: str, subject: str, body_html: str):
@@ -237,14 +345,16 @@ def _send_via_gmail(to_addr: str, subject: str, body_html: str):
             s.login(GMAIL_USER, GMAIL_APP_PASS)
             s.sendmail(from_addr, to_addr, msg.as_string())
         print(f'[Gmail] sent to {to_addr}')
+        return True
     except Exception as e:
         print(f'[Gmail error] {e}')
+        return False
 
 
-def send_sms(to_phone: str, body: str):
-    """透過 Twilio 發送 SMS，未設定則略過"""
+def send_sms(to_phone: str, body: str) -> bool:
+    """透過 Twilio 發送 SMS，未設定則略過；回傳 False 表示發送失敗"""
     if not USE_TWILIO or not to_phone:
-        return
+        return True
     # 台灣 09xx → +886 9xx
     phone = to_phone.strip().replace('-', '').replace(' ', '')
     if phone.startswith('0'):
@@ -252,7 +362,7 @@ def send_sms(to_phone: str, body: str):
     elif not phone.startswith('+'):
         phone = '+886' + phone
     try:
-        resp = http_requests.post(
+        resp = http_post(
             f'https://api.twilio.com/2010-04-01/Accounts/{TWILIO_SID}/Messages.json',
             auth=(TWILIO_SID, TWILIO_TOKEN),
             data={'From': TWILIO_FROM, 'To': phone, 'Body': body},
@@ -261,10 +371,12 @@ def send_sms(to_phone: str, body: str):
         data = resp.json()
         if resp.status_code >= 400:
             print(f'[Twilio error] {data}')
-        else:
-            print(f'[Twilio] SMS sent to {phone}')
+            return False
+        print(f'[Twilio] SMS sent to {phone}')
+        return True
     except Exception as e:
         print(f'[Twilio error] {e}')
+        return False
 
 
 def _booking_email_html(booking) -> str:
@@ -356,6 +468,40 @@ def _cancel_email_html(booking) -> str:
 </div></body></html>'''
 
 
+def _series_summary_text(series, bookings, conflicts=()) -> str:
+    """週期性預約摘要（LINE / SMS / 管理員共用）"""
+    room = series.room.name if series.room else '—'
+    lines = [f'【週期預約確認】{room}',
+             f'時段：每次 {series.start_time}–{series.end_time}',
+             f'共 {len(bookings)} 次：{bookings[0].date} ～ {bookings[-1].date}']
+    if conflicts:
+        lines.append(f'以下 {len(conflicts)} 次因時段衝突未預約：' + '、'.join(conflicts))
+    return '\n'.join(lines)
+
+
+def _series_email_html(series, bookings, conflicts=()) -> str:
+    room = series.room.name if series.room else '—'
+    rows = ''.join(f'<tr><td>{b.date}</td><td>{b.start_time}–{b.end_time}</td>'
+                   f'<td>{b.booking_number}</td></tr>' for b in bookings)
+    skipped = (f'<p>以下日期因時段衝突未預約：{"、".join(conflicts)}</p>' if conflicts else '')
+    total = sum(b.total_price or 0 for b in bookings)
+    return f'''<!DOCTYPE html><html lang="zh-TW"><head><meta charset="UTF-8">
+<style>body{{font-family:sans-serif;background:#f5f2ed;margin:0;padding:20px;}}
+.wrap{{max-width:540px;margin:0 auto;background:#fff;border-radius:8px;overflow:hidden;box-shadow:0 4px 20px rgba(0,0,0,.1);}}
+.hd{{background:#1a3333;padding:28px 32px;}}
+.hd-chip{{display:inline-block;background:#2A6B6B;color:#fff;font-size:12px;font-weight:700;padding:4px 14px;border-radius:20px;margin-bottom:12px;}}
+.hd h1{{color:#fff;font-size:22px;margin:0 0 4px;}}
+.hd p{{color:rgba(255,255,255,.6);font-size:13px;margin:0;}}
+.bd{{padding:24px 32px;font-size:14px;color:#555;line-height:1.7;}}
+table{{width:100%;border-collapse:collapse;}} td{{padding:6px 0;border-bottom:1px solid #f0f0f0;}}
+.ft{{text-align:center;padding:16px;color:#aaa;font-size:12px;background:#f8f8f8;}}</style></head><body>
+<div class="wrap">
+  <div class="hd"><div class="hd-chip">週期預約成功</div><h1>{room}</h1><p>共 {len(bookings)} 次 · NT$ {total:,}</p></div>
+  <div class="bd"><table>{rows}</table>{skipped}</div>
+  <div class="ft">感謝您的使用。</div>
+</div></body></html>'''
+
+
 # ─────────────────────────────────────────────
 # Flex Message 元件
 # ─────────────────────────────────────────────
@@ -1177,6 +1323,12 @@ def flex_admin_notify(booking) -> dict:
 # Models
 # ─────────────────────────────────────────────
 
+def _dialect_index(dialect: str, name: str, *cols):
+    """只在指定資料庫建立的索引：create_all 以 ddl_if 判斷，
+    ensure_indexes 讀 info['dialect'] 判斷"""
+    return db.Index(name, *cols, info={'dialect': dialect}).ddl_if(dialect=dialect)
+
+
 class Room(db.Model):
     __tablename__ = 'rooms'
     id          = db.Column(db.Integer, primary_key=True)
@@ -1255,8 +1407,33 @@ class Booking(db.Model):
     status         = db.Column(db.String(20), default='confirmed')
     note           = db.Column(db.Text)
     line_user_id   = db.Column(db.String(100))   # 綁定 LINE userId
+    series_id      = db.Column(db.Integer, db.ForeignKey('booking_series.id'), index=True)
     created_at     = db.Column(db.DateTime, default=tw_now)
     room           = db.relationship('Room', backref='bookings')
+    segment_rows   = db.relationship('BookingSegment', backref='booking',
+                                     cascade='all, delete-orphan')
+    __table_args__ = (
+        # 衝突檢查 / 日曆 / 統計：room_id + date (+ status) 篩選
+        db.Index('ix_bookings_room_date_status', 'room_id', 'date', 'status'),
+        # 「我的預約」：依 LINE userId 或電話查詢，再依建立時間倒序
+        db.Index('ix_bookings_line_user_created', 'line_user_id', 'created_at'),
+        db.Index('ix_bookings_phone_created', 'customer_phone', 'created_at'),
+        # 後台列表 keyset 分頁：ORDER BY created_at DESC NULLS LAST, id DESC
+        # SQLite 的 NULL 本來就排在 DESC 最後，一般索引反向掃描即可；
+        # PostgreSQL 反向掃描會得到 NULLS FIRST，需另建同排序的索引
+        _dialect_index('sqlite', 'ix_bookings_created_id', 'created_at', 'id'),
+        _dialect_index('postgresql', 'ix_bookings_created_id_nulls_last',
+                       db.text('created_at DESC NULLS LAST'), db.text('id DESC')),
+    )
+
+    def sync_segments(self):
+        """依 segments / start_time / end_time 重建 booking_segments 子表資料"""
+        self.segment_rows = [
+            BookingSegment(room_id=self.room_id, date=self.date,
+                           start_min=_to_min(seg['start']),
+                           end_min=_to_min(seg['end']))
+            for seg in _booking_segments(self)
+        ]
 
     def to_dict(self):
         return {
@@ -1271,10 +1448,152 @@ class Booking(db.Model):
             'duration': self.duration, 'total_price': self.total_price,
             'attendees': self.attendees, 'purpose': self.purpose,
             'status': self.status, 'note': self.note,
+            'series_id': self.series_id,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M') if self.created_at else ''
         }
 
 
+class BookingSeries(db.Model):
+    """週期性預約（每週 / 隔週 / 每月），各次預約以 bookings.series_id 關聯"""
+    __tablename__ = 'booking_series'
+    id             = db.Column(db.Integer, primary_key=True)
+    room_id        = db.Column(db.Integer, db.ForeignKey('rooms.id'), nullable=False)
+    rule           = db.Column(db.String(200), nullable=False)   # RRULE，例 FREQ=WEEKLY;INTERVAL=2;COUNT=10
+    start_time     = db.Column(db.String(5), nullable=False)
+    end_time       = db.Column(db.String(5), nullable=False)
+    first_date     = db.Column(db.String(10), nullable=False)
+    last_date      = db.Column(db.String(10), nullable=False)
+    customer_name  = db.Column(db.String(50), nullable=False)
+    customer_phone = db.Column(db.String(20), nullable=False)
+    customer_email = db.Column(db.String(100))
+    line_user_id   = db.Column(db.String(100))
+    created_at     = db.Column(db.DateTime, default=tw_now)
+    room           = db.relationship('Room')
+    bookings       = db.relationship('Booking', backref='series', order_by='Booking.date')
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'room_id': self.room_id,
+            'room_name': self.room.name if self.room else '',
+            'rule': self.rule, 'start_time': self.start_time, 'end_time': self.end_time,
+            'first_date': self.first_date, 'last_date': self.last_date,
+            'customer_name': self.customer_name,
+            'bookings': [{'id': b.id, 'booking_number': b.booking_number,
+                          'date': b.date, 'status': b.status} for b in self.bookings],
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M') if self.created_at else '',
+        }
+
+
+class BookingSegment(db.Model):
+    """預約時段正規化子表：每段一列，以整數分鐘儲存，供 SQL 直接做重疊判斷"""
+    __tablename__ = 'booking_segments'
+    id         = db.Column(db.Integer, primary_key=True)
+    booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id', ondelete='CASCADE'),
+                           nullable=False, index=True)
+    room_id    = db.Column(db.Integer, db.ForeignKey('rooms.id'), nullable=False)
+    date       = db.Column(db.String(10), nullable=False)   # YYYY-MM-DD
+    start_min  = db.Column(db.Integer, nullable=False)      # 當日分鐘數，例 08:30 → 510
+    end_min    = db.Column(db.Integer, nullable=False)
+    __table_args__ = (
+        db.Index('ix_booking_segments_room_date_start', 'room_id', 'date', 'start_min'),
+    )
+
+
+class BookingLock(db.Model):
+    """每個 (會議室, 日期) 一列的鎖定列；建立預約前先鎖定，序列化同房同日的寫入"""
+    __tablename__ = 'booking_locks'
+    id        = db.Column(db.Integer, primary_key=True)
+    room_id   = db.Column(db.Integer, db.ForeignKey('rooms.id'), nullable=False)
+    date      = db.Column(db.String(10), nullable=False)
+    locked_at = db.Column(db.DateTime, default=tw_now)
+    __table_args__ = (db.UniqueConstraint('room_id', 'date', name='uq_booking_locks_room_date'),)
+
+
+class BookingCounter(db.Model):
+    """每日預約編號計數器（day = YYYYMMDD，value = 當日已配發的最後序號）"""
+    __tablename__ = 'booking_counters'
+    day   = db.Column(db.String(8), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+class BookingDailyStat(db.Model):
+    """每日統計彙總（每間會議室 × 每日 × 每種狀態），預約寫入時同交易增量更新"""
+    __tablename__ = 'booking_daily_stats'
+    id             = db.Column(db.Integer, primary_key=True)
+    room_id        = db.Column(db.Integer, nullable=False)
+    date           = db.Column(db.String(10), nullable=False)
+    status         = db.Column(db.String(20), nullable=False)
+    booking_count  = db.Column(db.Integer, nullable=False, default=0)
+    revenue        = db.Column(db.Integer, nullable=False, default=0)
+    booked_minutes = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (
+        db.UniqueConstraint('room_id', 'date', 'status', name='uq_booking_daily_stats_room_date_status'),
+        db.Index('ix_booking_daily_stats_date', 'date'),
+    )
+
+
+class NotificationOutbox(db.Model):
+    """待發送通知（LINE / Email / SMS），與預約寫入同一交易，由背景 dispatcher 發送"""
+    __tablename__ = 'notification_outbox'
+    id              = db.Column(db.Integer, primary_key=True)
+    channel         = db.Column(db.String(20), nullable=False)    # line / line_multicast / email / sms
+    target          = db.Column(db.String(200), nullable=False)   # userId / Email / 手機
+    payload         = db.Column(db.Text, nullable=False)          # JSON
+    status          = db.Column(db.String(10), default='pending') # pending / sending / sent / failed
+    attempts        = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=tw_now)
+    claimed_at      = db.Column(db.DateTime)
+    last_error      = db.Column(db.String(300), default='')
+    created_at      = db.Column(db.DateTime, default=tw_now)
+    sent_at         = db.Column(db.DateTime)
+    __table_args__ = (
+        db.Index('ix_notification_outbox_status_next', 'status', 'next_attempt_at'),
+    )
+
+
+class BroadcastJob(db.Model):
+    """LINE 廣播背景工作：進度與每個 multicast 批次的結果"""
+    __tablename__ = 'broadcast_jobs'
+    id          = db.Column(db.Integer, primary_key=True)
+    message     = db.Column(db.Text, nullable=False)
+    admins_only = db.Column(db.Boolean, default=False)
+    status      = db.Column(db.String(10), default='queued')   # queued / running / done / failed
+    total       = db.Column(db.Integer, default=0)
+    sent        = db.Column(db.Integer, default=0)
+    failed      = db.Column(db.Integer, default=0)
+    chunks      = db.Column(db.Text, default='[]')   # JSON: [{"index":0,"size":500,"ok":true,"error":""},...]
+    created_by  = db.Column(db.String(50), default='')
+    created_at  = db.Column(db.DateTime, default=tw_now)
+    updated_at  = db.Column(db.DateTime, default=tw_now, onupdate=tw_now)   # 心跳：每批完成即更新
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'message': self.message, 'admins_only': self.admins_only,
+            'status': self.status, 'total': self.total,
+            'sent': self.sent, 'failed': self.failed,
+            'chunks': json.loads(self.chunks or '[]'),
+            'created_by': self.created_by,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else '',
+            'finished_at': self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else '',
+        }
+
+
+class CacheVersion(db.Model):
+    """跨 worker 共用的快取版本號：資料變更時 +1，各 worker 比對版本決定是否重新載入"""
+    __tablename__ = 'cache_versions'
+    name    = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class SchemaVersion(db.Model):
+    """資料庫 schema 版本（單列）：記錄 MIGRATIONS 已套用到第幾步"""
+    __tablename__ = 'schema_version'
+    id         = db.Column(db.Integer, primary_key=True)   # 固定為 1
+    version    = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=tw_now, onupdate=tw_now)
+
+
 class SiteContent(db.Model):
     __tablename__ = 'site_content'
     id         = db.Column(db.Integer, primary_key=True)
@@ -1282,21 +1601,52 @@ class SiteContent(db.Model):
     value      = db.Column(db.Text)
     updated_at = db.Column(db.DateTime, default=tw_now, onupdate=tw_now)
 
+    @staticmethod
+    def all_values() -> dict:
+        """整份 key/value（行程內快取，一次查詢載入；版本號變更時重新載入）"""
+        version = cache_version('site_content')
+        if _site_content_cache['version'] != version:
+            _site_content_cache.update(
+                data={k: v for k, v in db.session.query(SiteContent.key, SiteContent.value).all()},
+                version=version)
+        return _site_content_cache['data']
+
     @staticmethod
     def get(key, default=''):
-        obj = SiteContent.query.filter_by(key=key).first()
-        return obj.value if obj else default
+        data = SiteContent.all_values()
+        return data[key] if key in data else default
 
     @staticmethod
     def set(key, value):
-        obj = SiteContent.query.filter_by(key=key).first()
-        if obj:
-            obj.value = value
-            obj.updated_at = datetime.now()
-        else:
-            obj = SiteContent(key=key, value=value)
-            db.session.add(obj)
-        db.session.commit()
+        SiteContent.set_many({key: value})
+
+    @staticmethod
+    def set_many(items: dict):
+        """批次寫入多個設定：一次查詢比對現值，只 upsert 有變更的 key，單一交易完成"""
+        if not items:
+            return
+        current = dict(db.session.query(SiteContent.key, SiteContent.value)
+                       .filter(SiteContent.key.in_(list(items))).all())
+        now = datetime.now()
+        rows = [{'key': k, 'value': v, 'updated_at': now}
+                for k, v in items.items() if k not in current or current[k] != v]
+        if not rows:
+            return
+        insert = _dialect_insert()
+        stmt = insert(SiteContent.__table__).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['key'],
+            set_={'value': stmt.excluded.value, 'updated_at': stmt.excluded.updated_at})
+        try:
+            db.session.execute(stmt)
+            bump_cache_version('site_content')
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+_site_content_cache = {'version': None, 'data': {}}
 
 
 class BlockedSlot(db.Model):
@@ -1310,6 +1660,7 @@ class BlockedSlot(db.Model):
     reason     = db.Column(db.String(200), default='')
     created_at = db.Column(db.DateTime, default=tw_now)
     room       = db.relationship('Room', backref='blocked_slots')
+    __table_args__ = (db.Index('ix_blocked_slots_date_room', 'date', 'room_id'),)
 
     def to_dict(self):
         return {
@@ -1321,6 +1672,35 @@ class BlockedSlot(db.Model):
 
 
 
+class BlockedRule(db.Model):
+    """封鎖規則：日期區間 × 星期 × 時段 × 會議室，查詢可用時段時才展開，不逐日寫入 blocked_slots"""
+    __tablename__ = 'blocked_rules'
+    id         = db.Column(db.Integer, primary_key=True)
+    room_ids   = db.Column(db.Text)                         # JSON 陣列；NULL = 全館
+    date_from  = db.Column(db.String(10), nullable=False)   # YYYY-MM-DD
+    date_to    = db.Column(db.String(10), nullable=False)
+    weekdays   = db.Column(db.String(20), default='')       # 逗號分隔，0=週一 … 6=週日；空白 = 每天
+    start_time = db.Column(db.String(5), nullable=False)
+    end_time   = db.Column(db.String(5), nullable=False)
+    reason     = db.Column(db.String(200), default='')
+    created_at = db.Column(db.DateTime, default=tw_now)
+
+    def get_room_ids(self):
+        return json.loads(self.room_ids) if self.room_ids else None
+
+    def get_weekdays(self):
+        return [int(w) for w in (self.weekdays or '').split(',') if w.strip()]
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'room_ids': self.get_room_ids(),
+            'date_from': self.date_from, 'date_to': self.date_to,
+            'weekdays': self.get_weekdays(),
+            'start_time': self.start_time, 'end_time': self.end_time,
+            'reason': self.reason,
+        }
+
+
 class AdminUser(db.Model):
     __tablename__ = 'admin_users'
     id            = db.Column(db.Integer, primary_key=True)
@@ -1378,7 +1758,7 @@ class AdminLoginLog(db.Model):
     country     = db.Column(db.String(100), default='')
     city        = db.Column(db.String(100), default='')
     user_agent  = db.Column(db.String(300), default='')
-    login_at    = db.Column(db.DateTime, default=tw_now)
+    login_at    = db.Column(db.DateTime, default=tw_now, index=True)
     note        = db.Column(db.String(200), default='')
 
     def to_dict(self):
@@ -1397,9 +1777,9 @@ class LineUser(db.Model):
     __tablename__ = 'line_users'
     id              = db.Column(db.Integer, primary_key=True)
     line_user_id    = db.Column(db.String(100), unique=True, nullable=False)
-    phone           = db.Column(db.String(20))
+    phone           = db.Column(db.String(20), index=True)
     display_name    = db.Column(db.String(100))
-    is_admin        = db.Column(db.Boolean, default=False)
+    is_admin        = db.Column(db.Boolean, default=False, index=True)
     created_at      = db.Column(db.DateTime, default=tw_now)
     booking_session = db.Column(db.Text)  # JSON：儲存預約對話進度
 
@@ -1480,7 +1860,7 @@ def get_ip_location(ip):
     if not ip or ip in ('127.0.0.1', '::1', 'localhost'):
         return '本機', ''
     try:
-        r = http_requests.get(
+        r = http_get(
             f'http://ip-api.com/json/{ip}?fields=status,country,countryCode,city',
             timeout=3)
         d = r.json()
@@ -1496,90 +1876,1106 @@ def get_ip_location(ip):
 
 
 
+def _allocate_booking_seq(day: str, n: int = 1) -> int:
+    """原子地把 day 的計數器加 n，回傳配發後的最後序號
+
+    使用獨立連線立即 commit（類似 sequence），不與預約交易互鎖；
+    預約失敗時序號會跳號，但不會重複。
+    """
+    import time
+    insert = _dialect_insert()
+    tbl = BookingCounter.__table__
+    for attempt in range(5):
+        try:
+            with db.engine.begin() as conn:
+                exists = conn.execute(
+                    db.select(tbl.c.value).where(tbl.c.day == day)).first()
+                seed = 0
+                if not exists:
+                    # 當日第一次配發：接續既有預約編號（升級前建立的資料）
+                    last = conn.execute(
+                        db.select(func.max(Booking.booking_number)).where(
+                            Booking.booking_number.like(f'MR{day}%'))).scalar()
+                    if last and last[len(day) + 2:].isdigit():
+                        seed = int(last[len(day) + 2:])
+                stmt = insert(tbl).values(day=day, value=seed + n)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=['day'],
+                    set_={'value': tbl.c.value + n},
+                ).returning(tbl.c.value)
+                return conn.execute(stmt).scalar()
+        except Exception as e:
+            if attempt == 4:
+                raise
+            print(f'[booking counter retry] {type(e).__name__}: {e}')
+            time.sleep(0.05 * (2 ** attempt))
+
+
 def generate_booking_number():
+    return generate_booking_numbers(1)[0]
+
+
+def generate_booking_numbers(n: int) -> list:
+    """一次配發 n 個連續預約編號（計數器只更新一次）"""
     today = datetime.now().strftime('%Y%m%d')
-    count = Booking.query.filter(Booking.booking_number.like(f'MR{today}%')).count()
-    return f'MR{today}{str(count + 1).zfill(4)}'
+    last = _allocate_booking_seq(today, n)
+    return [f'MR{today}{str(seq).zfill(4)}' for seq in range(last - n + 1, last + 1)]
 
 
 def allowed_file(fn):
     return '.' in fn and fn.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-def check_availability(room_id, date, start_time, end_time, exclude_id=None):
-    """檢查單一時段是否可用（支援多段預約的 segments 展開，含封鎖時段）"""
-    import json as _json
-    def m(t): h, mn = map(int, t.split(':')); return h*60+mn
-    s, e = m(start_time), m(end_time)
-    # 一般預約衝突
-    bookings = Booking.query.filter_by(room_id=room_id, date=date).filter(
-        Booking.status.in_(['confirmed', 'completed'])).all()
+def _to_min(t: str) -> int:
+    """'HH:MM' → 當日分鐘數"""
+    h, mn = map(int, t.split(':'))
+    return h * 60 + mn
+
+
+def _parse_segments(segments, start_time, end_time) -> list:
+    segs = []
+    if segments:
+        try: segs = json.loads(segments)
+        except Exception: pass
+    if not segs:
+        segs = [{'start': start_time, 'end': end_time}]
+    return segs
+
+
+def _booking_segments(b) -> list:
+    """展開預約的 segments（多段時段）；舊資料沒有 segments 則回傳單段"""
+    return _parse_segments(b.segments, b.start_time, b.end_time)
+
+
+class Occupancy:
+    """單一會議室單日的占用區間索引
+
+    預約與封鎖時段在建立時合併成排序、互不重疊的分鐘區間，
+    之後每次 overlaps() 查詢只需一次二分搜尋。
+    """
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self, intervals=()):
+        merged = []
+        for s, e in sorted(intervals):
+            if e <= s:
+                continue
+            if merged and s <= merged[-1][1]:
+                if e > merged[-1][1]:
+                    merged[-1][1] = e
+            else:
+                merged.append([s, e])
+        self.starts = [s for s, _ in merged]
+        self.ends   = [e for _, e in merged]
+
+    def overlaps(self, start: int, end: int) -> bool:
+        """[start, end) 是否與任一占用區間重疊"""
+        i = bisect.bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] < end
+
+    def is_free(self, start_time: str, end_time: str) -> bool:
+        return not self.overlaps(_to_min(start_time), _to_min(end_time))
+
+
+ACTIVE_STATUSES = ('confirmed', 'completed')
+
+
+def _fmt_min(m: int) -> str:
+    """當日分鐘數 → 'HH:MM'"""
+    return f'{m // 60:02d}:{m % 60:02d}'
+
+
+def _active_segments_query(room_id, date, exclude_id=None):
+    """booking_segments JOIN bookings：指定會議室當日有效預約的時段列"""
+    q = db.session.query(BookingSegment.start_min, BookingSegment.end_min).join(
+        Booking, BookingSegment.booking_id == Booking.id).filter(
+        BookingSegment.room_id == room_id, BookingSegment.date == date,
+        Booking.status.in_(ACTIVE_STATUSES))
     if exclude_id:
-        bookings = [b for b in bookings if b.id != exclude_id]
-    for b in bookings:
-        segs = []
-        if b.segments:
-            try: segs = _json.loads(b.segments)
-            except Exception: pass
-        if not segs:
-            segs = [{'start': b.start_time, 'end': b.end_time}]
-        for seg in segs:
-            if not (e <= m(seg['start']) or s >= m(seg['end'])):
-                return False
-    # 封鎖時段衝突（全館 + 指定房間）
-    blocked = BlockedSlot.query.filter_by(date=date).filter(
-        (BlockedSlot.room_id == room_id) | (BlockedSlot.room_id.is_(None))
-    ).all()
+        q = q.filter(BookingSegment.booking_id != exclude_id)
+    return q
+
+
+# 封鎖時段：blocked_slots 單筆資料 + blocked_rules 規則展開，欄位同 BlockedSlot（room_id None = 全館）
+BlockedInterval = namedtuple('BlockedInterval', 'room_id date start_time end_time reason')
+_blocked_rules_cache = {'version': None, 'rules': []}
+
+
+def _blocked_rules() -> list:
+    """所有封鎖規則（行程內快取，新增 / 刪除規則時以 cache_version('blocked_rules') 失效）"""
+    version = cache_version('blocked_rules')
+    if _blocked_rules_cache['version'] != version:
+        _blocked_rules_cache['rules'] = [
+            (r.get_room_ids(), r.date_from, r.date_to, frozenset(r.get_weekdays()),
+             r.start_time, r.end_time, r.reason or '')
+            for r in BlockedRule.query.all()]
+        _blocked_rules_cache['version'] = version
+    return _blocked_rules_cache['rules']
+
+
+def blocked_intervals(date_from, date_to, room_ids=None) -> list:
+    """[date_from, date_to] 內影響 room_ids（None = 不限）的封鎖時段
+
+    blocked_slots 一次查詢；規則只在此展開成區間，不寫入資料表。
+    """
+    q = BlockedSlot.query.filter(BlockedSlot.date >= date_from, BlockedSlot.date <= date_to)
+    if room_ids is not None:
+        q = q.filter(BlockedSlot.room_id.in_(room_ids) | BlockedSlot.room_id.is_(None))
+    result = [BlockedInterval(bl.room_id, bl.date, bl.start_time, bl.end_time, bl.reason or '')
+              for bl in q.all()]
+    wanted = set(room_ids) if room_ids is not None else None
+    for rule_rooms, r_from, r_to, weekdays, start, end, reason in _blocked_rules():
+        lo, hi = max(date_from, r_from), min(date_to, r_to)
+        if lo > hi:
+            continue
+        if rule_rooms is None:
+            targets = [None]
+        else:
+            targets = [rid for rid in rule_rooms if wanted is None or rid in wanted]
+            if not targets:
+                continue
+        d, last = datetime.strptime(lo, '%Y-%m-%d'), datetime.strptime(hi, '%Y-%m-%d')
+        while d <= last:
+            if not weekdays or d.weekday() in weekdays:
+                ds = d.strftime('%Y-%m-%d')
+                result.extend(BlockedInterval(rid, ds, start, end, reason) for rid in targets)
+            d += timedelta(days=1)
+    return result
+
+
+def load_occupancy(room_id, date, exclude_id=None, window=None) -> Occupancy:
+    """讀取會議室當日的預約時段 + 封鎖時段，建立 Occupancy
+
+    window=(start_min, end_min) 時只在 SQL 端取出與此範圍重疊的時段列。
+    """
+    q = _active_segments_query(room_id, date, exclude_id)
+    if window:
+        q = q.filter(BookingSegment.start_min < window[1],
+                     BookingSegment.end_min > window[0])
+    intervals = [(s, e) for s, e in q.all()]
+    for bl in blocked_intervals(date, date, [room_id]):
+        intervals.append((_to_min(bl.start_time), _to_min(bl.end_time)))
+    return Occupancy(intervals)
+
+
+def check_availability(room_id, date, start_time, end_time, exclude_id=None, occ=None):
+    """檢查單一時段是否可用（支援多段預約的 segments 展開，含封鎖時段）
+
+    已有 Occupancy 時傳入 occ；否則直接以 SQL 判斷重疊。
+    """
+    if occ is not None:
+        return occ.is_free(start_time, end_time)
+    s, e = _to_min(start_time), _to_min(end_time)
+    hit = _active_segments_query(room_id, date, exclude_id).filter(
+        BookingSegment.start_min < e, BookingSegment.end_min > s).first()
+    if hit:
+        return False
+    # 封鎖時段為零補齊的 HH:MM，字串比較即時間順序
+    return not any(bl.start_time < _fmt_min(e) and bl.end_time > _fmt_min(s)
+                   for bl in blocked_intervals(date, date, [room_id]))
+
+
+def check_segments_availability(room_id, date, segments, exclude_id=None):
+    """檢查多段時段是否全部可用（整批只查詢一次）"""
+    window = (min(_to_min(seg['start']) for seg in segments),
+              max(_to_min(seg['end']) for seg in segments))
+    occ = load_occupancy(room_id, date, exclude_id, window)
+    for seg in segments:
+        if not occ.is_free(seg['start'], seg['end']):
+            return False, seg
+    return True, None
+
+
+def load_occupancy_range(room_id, dates) -> dict:
+    """多個日期的 Occupancy（預約時段、封鎖時段各一次查詢），回傳 {date: Occupancy}"""
+    intervals = {d: [] for d in dates}
+    if not intervals:
+        return {}
+    for d, s, e in db.session.query(
+            BookingSegment.date, BookingSegment.start_min, BookingSegment.end_min
+    ).join(Booking, BookingSegment.booking_id == Booking.id).filter(
+            BookingSegment.room_id == room_id, BookingSegment.date.in_(intervals),
+            Booking.status.in_(ACTIVE_STATUSES)).all():
+        intervals[d].append((s, e))
+    for bl in blocked_intervals(min(intervals), max(intervals), [room_id]):
+        if bl.date in intervals:
+            intervals[bl.date].append((_to_min(bl.start_time), _to_min(bl.end_time)))
+    return {d: Occupancy(iv) for d, iv in intervals.items()}
+
+
+# ── 週期性預約 ──
+SERIES_MAX_OCCURRENCES = 100
+SERIES_MAX_INTERVAL    = 12    # INTERVAL 上限（每 N 週 / 每 N 月）
+_RECURRENCE_ALIASES = {'weekly': ('WEEKLY', 1), 'biweekly': ('WEEKLY', 2), 'monthly': ('MONTHLY', 1)}
+
+
+def parse_recurrence(spec) -> dict:
+    """RRULE 字串（FREQ=WEEKLY;INTERVAL=2;COUNT=10 / UNTIL=20270430）或
+    {'freq': 'weekly'|'biweekly'|'monthly', 'interval', 'count', 'until'} → 正規化 dict"""
+    if isinstance(spec, str):
+        parts = dict(p.split('=', 1) for p in spec.upper().replace('RRULE:', '').split(';') if '=' in p)
+        freq = parts.get('FREQ', '')
+        try:
+            interval = int(parts.get('INTERVAL', 1))
+            count = int(parts['COUNT']) if 'COUNT' in parts else None
+        except ValueError:
+            raise ValueError('重複規則數值錯誤')
+        until = parts.get('UNTIL')
+        if until:
+            try:
+                until = datetime.strptime(until[:8], '%Y%m%d').strftime('%Y-%m-%d')
+            except ValueError:
+                raise ValueError('UNTIL 格式需為 YYYYMMDD')
+    elif isinstance(spec, dict):
+        freq, interval = _RECURRENCE_ALIASES.get(str(spec.get('freq', '')).lower(), ('', 1))
+        try:
+            interval = int(spec.get('interval') or interval)
+            count = int(spec['count']) if spec.get('count') else None
+        except (TypeError, ValueError):
+            raise ValueError('重複規則數值錯誤')
+        until = spec.get('until') or None
+        if until:
+            try:
+                datetime.strptime(until, '%Y-%m-%d')
+            except (TypeError, ValueError):
+                raise ValueError('結束日期格式需為 YYYY-MM-DD')
+    else:
+        raise ValueError('缺少重複規則')
+    if freq not in ('WEEKLY', 'MONTHLY'):
+        raise ValueError('重複頻率僅支援每週、隔週或每月')
+    if not 1 <= interval <= SERIES_MAX_INTERVAL or (count is not None and count < 1):
+        raise ValueError(f'重複規則數值錯誤（間隔需為 1–{SERIES_MAX_INTERVAL}）')
+    if count is None and until is None:
+        raise ValueError('請指定結束日期或次數')
+    if count and count > SERIES_MAX_OCCURRENCES:
+        raise ValueError(f'週期性預約最多 {SERIES_MAX_OCCURRENCES} 次')
+    return {'freq': freq, 'interval': interval, 'count': count, 'until': until}
+
+
+def recurrence_rule_str(rule: dict) -> str:
+    s = f"FREQ={rule['freq']};INTERVAL={rule['interval']}"
+    if rule['count']:
+        s += f";COUNT={rule['count']}"
+    if rule['until']:
+        s += f";UNTIL={rule['until'].replace('-', '')}"
+    return s
+
+
+def expand_recurrence(first_date: str, rule: dict) -> list:
+    """展開各次日期（YYYY-MM-DD）；每月規則遇到不存在的日期（例 31 日）略過該月"""
+    from datetime import date as _date
+    d0 = datetime.strptime(first_date, '%Y-%m-%d').date()
+    dates, k = [], 0
+    # 每月規則最壞情況為 2/29（約每 4 次才有 1 次存在），超過即停止
+    max_steps = SERIES_MAX_OCCURRENCES * 4
+    while k <= max_steps:
+        if rule['freq'] == 'WEEKLY':
+            d = d0 + timedelta(weeks=k * rule['interval'])
+        else:
+            m = d0.month - 1 + k * rule['interval']
+            year, month = d0.year + m // 12, m % 12 + 1
+            if rule['until'] and f'{year:04d}-{month:02d}-01' > rule['until']:
+                break
+            try:
+                d = _date(year, month, d0.day)
+            except ValueError:
+                k += 1
+                continue
+        ds = d.strftime('%Y-%m-%d')
+        if rule['until'] and ds > rule['until']:
+            break
+        dates.append(ds)
+        if rule['count'] and len(dates) >= rule['count']:
+            break
+        if len(dates) > SERIES_MAX_OCCURRENCES:
+            raise ValueError(f'週期性預約最多 {SERIES_MAX_OCCURRENCES} 次')
+        k += 1
+    return dates
+
+
+# ── 每日統計彙總（booking_daily_stats）──
+# 每次 flush 前比對 Booking 的新增 / 修改 / 刪除，把差額 upsert 到彙總表，
+# 與預約寫入同一交易；統計與趨勢 API 只讀彙總表，不再掃描 bookings。
+_STAT_ATTRS = ('room_id', 'date', 'status', 'total_price', 'segments', 'start_time', 'end_time')
+
+
+def _stat_entry(room_id, date, status, total_price, segments, start_time, end_time):
+    """預約欄位 → ((room_id, date, status), (筆數, 金額, 分鐘數))；資料不完整回傳 None"""
+    if room_id is None or not date or not status:
+        return None
+    try:
+        minutes = sum(max(0, _to_min(s['end']) - _to_min(s['start']))
+                      for s in _parse_segments(segments, start_time, end_time))
+    except Exception:
+        minutes = 0
+    return (room_id, date, status), (1, total_price or 0, minutes)
+
+
+def _booking_stat_entry(b):
+    vals = [getattr(b, key) for key in _STAT_ATTRS]
+    if vals[2] is None:
+        vals[2] = Booking.__table__.c.status.default.arg
+    return _stat_entry(*vals)
+
+
+def _add_stat_delta(deltas, entry, sign):
+    if entry is None:
+        return
+    key, (n, revenue, minutes) = entry
+    d = deltas.setdefault(key, [0, 0, 0])
+    d[0] += sign * n
+    d[1] += sign * revenue
+    d[2] += sign * minutes
+
+
+def apply_stat_deltas(session, deltas):
+    """把 {(room_id, date, status): [筆數, 金額, 分鐘數]} 的差額 upsert 到 booking_daily_stats"""
+    insert = _dialect_insert()
+    tbl = BookingDailyStat.__table__
+    for (room_id, date, status), (n, revenue, minutes) in deltas.items():
+        if not (n or revenue or minutes):
+            continue
+        stmt = insert(tbl).values(room_id=room_id, date=date, status=status, booking_count=n,
+                                  revenue=revenue, booked_minutes=minutes)
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=['room_id', 'date', 'status'],
+            set_={'booking_count':  tbl.c.booking_count + stmt.excluded.booking_count,
+                  'revenue':        tbl.c.revenue + stmt.excluded.revenue,
+                  'booked_minutes': tbl.c.booked_minutes + stmt.excluded.booked_minutes}))
+    # 取消 / 刪除後歸零的列直接移除，與 rebuild_daily_stats（只產生有預約的列）結果一致
+    emptied = [k for k, (n, _, _) in deltas.items() if n < 0]
+    for room_id, date, status in emptied:
+        session.execute(db.delete(tbl).where(
+            tbl.c.room_id == room_id, tbl.c.date == date, tbl.c.status == status,
+            tbl.c.booking_count == 0, tbl.c.revenue == 0, tbl.c.booked_minutes == 0))
+
+
+@sa_event.listens_for(db.session, 'before_flush')
+def _rollup_booking_stats(session, flush_context, instances):
+    deltas = {}
+    for obj in session.new:
+        if isinstance(obj, Booking):
+            _add_stat_delta(deltas, _booking_stat_entry(obj), 1)
+    changed = [obj for obj in session.dirty
+               if isinstance(obj, Booking) and obj.id is not None
+               and any(db.inspect(obj).attrs[k].history.added for k in _STAT_ATTRS)]
+    deleted = [obj for obj in session.deleted if isinstance(obj, Booking)]
+    if changed or deleted:
+        # 修改前的值一律以資料庫為準（物件 commit 後已 expire，history 不一定保有舊值）
+        cols = [getattr(Booking.__table__.c, k) for k in _STAT_ATTRS]
+        old_rows = session.execute(db.select(Booking.__table__.c.id, *cols).where(
+            Booking.__table__.c.id.in_([o.id for o in changed + deleted]))).all()
+        for row in old_rows:
+            _add_stat_delta(deltas, _stat_entry(*row[1:]), -1)
+        for obj in changed:
+            _add_stat_delta(deltas, _booking_stat_entry(obj), 1)
+    if deltas:
+        apply_stat_deltas(session, deltas)
+
+
+def rebuild_daily_stats():
+    """由 bookings + booking_segments 全量重建彙總表（啟動回填 / flask rebuild-daily-stats）"""
+    minutes = db.session.query(
+        BookingSegment.booking_id.label('booking_id'),
+        func.sum(BookingSegment.end_min - BookingSegment.start_min).label('minutes')
+    ).group_by(BookingSegment.booking_id).subquery()
+    rows = db.session.query(
+        Booking.room_id, Booking.date, Booking.status, func.count(Booking.id),
+        func.coalesce(func.sum(Booking.total_price), 0),
+        func.coalesce(func.sum(minutes.c.minutes), 0)
+    ).outerjoin(minutes, minutes.c.booking_id == Booking.id).filter(
+        Booking.room_id.isnot(None), Booking.status.isnot(None)
+    ).group_by(Booking.room_id, Booking.date, Booking.status).all()
+    BookingDailyStat.query.delete()
+    db.session.add_all([BookingDailyStat(room_id=r, date=d, status=s, booking_count=n,
+                                         revenue=int(rev), booked_minutes=int(m))
+                        for r, d, s, n, rev, m in rows])
+    db.session.commit()
+    return len(rows)
+
+
+# ── 快取版本號 ──
+# 各 worker 最多每 CACHE_VERSION_CHECK_SECONDS 秒查詢一次版本號，
+# 其餘時間直接使用行程內快取（穩定狀態下零查詢）
+CACHE_VERSION_CHECK_SECONDS = float(os.environ.get('CACHE_VERSION_CHECK_SECONDS', '2'))
+_cache_versions = {}   # name → (version, checked_at)
+
+
+def cache_version(name: str) -> int:
+    import time
+    now = time.time()
+    cached = _cache_versions.get(name)
+    if cached and now - cached[1] < CACHE_VERSION_CHECK_SECONDS:
+        return cached[0]
+    version = db.session.query(CacheVersion.version).filter_by(name=name).scalar() or 0
+    _cache_versions[name] = (version, now)
+    return version
+
+
+def bump_cache_version(name: str):
+    """在目前交易內把版本號 +1（隨呼叫端 commit 生效），本 worker 下次讀取立即重新檢查"""
+    insert = _dialect_insert()
+    tbl = CacheVersion.__table__
+    db.session.execute(insert(tbl).values(name=name, version=1).on_conflict_do_update(
+        index_elements=['name'], set_={'version': tbl.c.version + 1}))
+    _cache_versions.pop(name, None)
+
+
+# ── 預先序列化的 JSON 回應（ETag / 304）──
+_response_cache = {}   # name → (version, body, etag)
+
+
+def cached_json_response(name: str, build):
+    """回傳 build() 的 JSON，序列化結果快取至 cache_version(name) 變更為止
+
+    附強 ETag；用戶端帶 If-None-Match 且內容未變時回 304。
+    Cache-Control: no-cache 讓瀏覽器每次都以 ETag 重新驗證，後台修改可立即生效。
+    """
+    version = cache_version(name)
+    cached = _response_cache.get(name)
+    if not cached or cached[0] != version:
+        body = app.json.dumps(build()).encode('utf-8')
+        cached = (version, body, hashlib.sha256(body).hexdigest()[:32])
+        _response_cache[name] = cached
+    _, body, etag = cached
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = app.response_class(body, mimetype='application/json')
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+
+def _dialect_insert():
+    """依資料庫回傳支援 ON CONFLICT 的 insert()（PostgreSQL / SQLite）"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def acquire_slot_lock(room_id, date):
+    """鎖定 (room, date)，直到目前交易 commit / rollback 為止
+
+    PostgreSQL：確保鎖定列存在後 SELECT ... FOR UPDATE（row lock）。
+    SQLite：沒有 row lock，改以 UPDATE 鎖定列取得資料庫寫入鎖，效果同樣是序列化。
+    """
+    insert = _dialect_insert()
+    db.session.execute(insert(BookingLock.__table__).values(
+        room_id=room_id, date=date, locked_at=tw_now()
+    ).on_conflict_do_nothing(index_elements=['room_id', 'date']))
+    if db.engine.dialect.name == 'postgresql':
+        BookingLock.query.filter_by(room_id=room_id, date=date).with_for_update().one()
+    else:
+        BookingLock.query.filter_by(room_id=room_id, date=date).update(
+            {'locked_at': tw_now()}, synchronize_session=False)
+
+
+def reserve_booking(booking, on_reserved=None):
+    """在 (room, date) 鎖內做最終衝突檢查並寫入預約
+
+    on_reserved(booking) 在 flush 後、commit 前呼叫（例如寫入通知 outbox），
+    與預約同一交易。回傳 (True, None)；時段衝突時 rollback 並回傳 (False, 衝突的時段)。
+    """
+    acquire_slot_lock(booking.room_id, booking.date)
+    ok, conflict = check_segments_availability(
+        booking.room_id, booking.date, _booking_segments(booking))
+    if not ok:
+        db.session.rollback()
+        return False, conflict
+    booking.sync_segments()
+    db.session.add(booking)
+    if on_reserved:
+        db.session.flush()
+        on_reserved(booking)
+    db.session.commit()
+    wake_outbox_dispatcher()
+    return True, None
+
+
+def get_booked_slots_bulk(date_from, date_to=None, room_ids=None):
+    """一次查詢多間會議室、多日的已預約 + 封鎖時段
+
+    回傳 {room_id: {date: [slot, ...]}}；room_ids 為 None 時取所有啟用中的會議室。
+    預約時段與封鎖時段各只查詢一次，再於 Python 端分組。
+    """
+    date_to = date_to or date_from
+    if room_ids is None:
+        room_ids = [r.id for r in Room.query.filter_by(is_active=True).all()]
+    result = {rid: {} for rid in room_ids}
+    if not room_ids:
+        return result
+
+    rows = db.session.query(BookingSegment, Booking.booking_number).join(
+        Booking, BookingSegment.booking_id == Booking.id).filter(
+        BookingSegment.room_id.in_(room_ids),
+        BookingSegment.date >= date_from, BookingSegment.date <= date_to,
+        Booking.status.in_(ACTIVE_STATUSES)
+    ).order_by(BookingSegment.booking_id, BookingSegment.id).all()
+    for seg, number in rows:
+        result[seg.room_id].setdefault(seg.date, []).append(
+            {'start': _fmt_min(seg.start_min), 'end': _fmt_min(seg.end_min),
+             'booking_number': number})
+    # 加入封鎖時段（全館 + 指定房間）
+    blocked = blocked_intervals(date_from, date_to, room_ids)
     for bl in blocked:
-        if not (e <= m(bl.start_time) or s >= m(bl.end_time)):
+        slot = {'start': bl.start_time, 'end': bl.end_time,
+                'blocked': True, 'reason': bl.reason or '不開放'}
+        targets = [bl.room_id] if bl.room_id is not None else room_ids
+        for rid in targets:
+            if rid in result:
+                result[rid].setdefault(bl.date, []).append(slot)
+    return result
+
+
+# 營業時段與時段格大小（前台時段表、LINE 選時段、樓層看板、統計共用）
+SLOT_DAY_START = _to_min(os.environ.get('SLOT_DAY_START', '08:00'))
+SLOT_DAY_END   = _to_min(os.environ.get('SLOT_DAY_END', '22:00'))
+SLOT_MINUTES   = int(os.environ.get('SLOT_MINUTES', '30'))
+
+
+class SlotGrid:
+    """單一會議室單日的時段格（營業時段內每 slot 分鐘一格）
+
+    占用以整數位元遮罩表示（第 i 位 = 第 i 格），mask 為預約、blocked_mask 為封鎖；
+    時間參數可用分鐘數或 'HH:MM'。部分重疊的格子視為占用。
+    """
+    __slots__ = ('day_start', 'day_end', 'slot', 'n', 'mask', 'blocked_mask')
+
+    def __init__(self, day_start=None, day_end=None, slot=None):
+        self.day_start = SLOT_DAY_START if day_start is None else day_start
+        self.day_end   = SLOT_DAY_END if day_end is None else day_end
+        self.slot      = slot or SLOT_MINUTES
+        self.n = -(-(self.day_end - self.day_start) // self.slot)
+        self.mask = 0
+        self.blocked_mask = 0
+
+    @classmethod
+    def from_slots(cls, slots, **window):
+        """由 get_booked_slots() 的結果建立（blocked=True 的項目記為封鎖）"""
+        grid = cls(**window)
+        for s in slots:
+            grid.mark(s['start'], s['end'], blocked=s.get('blocked', False))
+        return grid
+
+    @staticmethod
+    def _min(t):
+        return _to_min(t) if isinstance(t, str) else t
+
+    def range_mask(self, start, end) -> int:
+        """[start, end) → 有重疊的格子位元遮罩（超出營業時段的部分略去）"""
+        start, end = self._min(start), self._min(end)
+        si = max(0, (start - self.day_start) // self.slot)
+        ei = min(self.n, -(-(end - self.day_start) // self.slot))
+        return ((1 << (ei - si)) - 1) << si if ei > si else 0
+
+    def mark(self, start, end, blocked=False):
+        if blocked:
+            self.blocked_mask |= self.range_mask(start, end)
+        else:
+            self.mask |= self.range_mask(start, end)
+
+    @property
+    def occupied(self) -> int:
+        return self.mask | self.blocked_mask
+
+    def slot_start(self, i: int) -> int:
+        return self.day_start + i * self.slot
+
+    def is_free(self, start, end) -> bool:
+        """[start, end) 完全在營業時段內且沒有任何占用"""
+        start, end = self._min(start), self._min(end)
+        if start < self.day_start or end > self.day_end or end <= start:
             return False
+        return not self.occupied & self.range_mask(start, end)
+
+    def free_ranges(self) -> list:
+        """連續空閒區段 [(start_min, end_min), ...]"""
+        free = ~self.occupied & ((1 << self.n) - 1)
+        ranges = []
+        while free:
+            i = (free & -free).bit_length() - 1
+            x = free >> i
+            run = ((x + 1) & ~x).bit_length() - 1    # 自第 i 格起連續為 1 的格數
+            ranges.append((self.slot_start(i), min(self.day_end, self.slot_start(i + run))))
+            free &= ~(((1 << run) - 1) << i)
+        return ranges
+
+    def first_fit(self, duration: int):
+        """最早可容納 duration 分鐘的開始時間（分鐘數）；沒有則回傳 None"""
+        k = -(-duration // self.slot)
+        fits = ~self.occupied & ((1 << self.n) - 1)
+        # 每次位移後 AND：第 i 位保留 = 第 i..i+k-1 格皆空閒
+        span = 1
+        while span < k and fits:
+            step = min(span, k - span)
+            fits &= fits >> step
+            span += step
+        if not fits:
+            return None
+        start = self.slot_start((fits & -fits).bit_length() - 1)
+        return start if start + duration <= self.day_end else None
+
+    def to_list(self, blocked_only=False) -> list:
+        m = self.blocked_mask if blocked_only else self.occupied
+        return [bool(m >> i & 1) for i in range(self.n)]
+
+
+def load_slot_grid(room_id, date, **window) -> SlotGrid:
+    return SlotGrid.from_slots(get_booked_slots(room_id, date), **window)
+
+
+def floor_grid(room_ids, date_from, date_to, day_start=None, day_end=None, slot=None):
+    """多間會議室、多日的 SlotGrid（預約一次查詢、封鎖時段一次查詢）
+
+    回傳 {room_id: {date: cell}}，cell 含 grid（SlotGrid）、bookings、blocked；
+    沒有資料的日期不建立 cell。
+    """
+    window = {'day_start': day_start, 'day_end': day_end, 'slot': slot}
+    rooms = {rid: {} for rid in room_ids}
+    if not room_ids:
+        return rooms
+    probe = SlotGrid(**window)
+
+    def _cell(rid, d):
+        return rooms[rid].setdefault(d, {'grid': SlotGrid(**window),
+                                         'bookings': [], 'blocked': []})
+
+    rows = db.session.query(
+        BookingSegment.room_id, BookingSegment.date,
+        BookingSegment.start_min, BookingSegment.end_min,
+        Booking.id, Booking.booking_number, Booking.customer_name,
+        Booking.start_time, Booking.end_time, Booking.segments
+    ).join(Booking, BookingSegment.booking_id == Booking.id).filter(
+        BookingSegment.room_id.in_(room_ids),
+        BookingSegment.date >= date_from, BookingSegment.date <= date_to,
+        BookingSegment.start_min < probe.day_end, BookingSegment.end_min > probe.day_start,
+        Booking.status.in_(ACTIVE_STATUSES)
+    ).order_by(BookingSegment.date, BookingSegment.start_min).all()
+    seen = set()
+    for rid, d, s, e, bid, number, name, st, et, segs in rows:
+        cell = _cell(rid, d)
+        cell['grid'].mark(s, e)
+        if (bid, d) not in seen:
+            seen.add((bid, d))
+            cell['bookings'].append({'start': st, 'end': et, 'segments': segs,
+                                     'name': name, 'number': number})
+
+    blocked = blocked_intervals(date_from, date_to, room_ids)
+    for bl in blocked:
+        if not probe.range_mask(bl.start_time, bl.end_time):
+            continue
+        info = {'start': bl.start_time, 'end': bl.end_time, 'reason': bl.reason or '不開放'}
+        for rid in ([bl.room_id] if bl.room_id is not None else room_ids):
+            if rid in rooms:
+                cell = _cell(rid, bl.date)
+                cell['grid'].mark(bl.start_time, bl.end_time, blocked=True)
+                cell['blocked'].append(info)
+    return rooms
+
+
+def get_booked_slots(room_id, date):
+    return get_booked_slots_bulk(date, room_ids=[room_id])[room_id].get(date, [])
+
+
+# 管理員 LINE userId 快取：admin_toggle_line_admin 時清除；
+# 另設 TTL，讓其他 gunicorn worker 的變更最遲 ADMIN_IDS_TTL 秒內生效
+ADMIN_IDS_TTL = 60
+_admin_ids_cache = {'ids': None, 'loaded_at': 0.0}
+_admin_ids_lock = threading.Lock()
+
+
+def admin_line_ids():
+    import time
+    with _admin_ids_lock:
+        if (_admin_ids_cache['ids'] is not None
+                and time.time() - _admin_ids_cache['loaded_at'] < ADMIN_IDS_TTL):
+            return list(_admin_ids_cache['ids'])
+    ids = [uid for (uid,) in db.session.query(LineUser.line_user_id)
+           .filter(LineUser.is_admin == True).all()]
+    with _admin_ids_lock:
+        _admin_ids_cache.update(ids=ids, loaded_at=time.time())
+    return list(ids)
+
+
+def invalidate_admin_line_ids():
+    with _admin_ids_lock:
+        _admin_ids_cache.update(ids=None, loaded_at=0.0)
+
+
+def upsert_line_user(user_id, display_name=''):
+    lu = LineUser.query.filter_by(line_user_id=user_id).first()
+    if not lu:
+        lu = LineUser(line_user_id=user_id, display_name=display_name)
+        db.session.add(lu)
+        db.session.commit()
+    return lu
+
+
+# ─────────────────────────────────────────────
+# Notification Outbox
+# ─────────────────────────────────────────────
+# 通知先寫入 notification_outbox（與預約同一交易），再由背景 dispatcher
+# 以 thread pool 發送，失敗依指數退避重試。預約 API 不再等待 LINE / Email / SMS。
+# 部署多個 worker 時可設 OUTBOX_DISPATCHER=off，改以 `flask outbox-worker` 獨立執行。
+
+OUTBOX_DISPATCHER   = os.environ.get('OUTBOX_DISPATCHER', 'thread')   # thread / off
+OUTBOX_WORKERS      = int(os.environ.get('OUTBOX_WORKERS', '4'))
+OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', '5'))
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_STALE_SECONDS = 300   # sending 超過此秒數視為 worker 中斷，重新領取
+
+_outbox_wakeup = threading.Event()
+
+
+def enqueue_notification(channel: str, target: str, payload: dict):
+    """加入一筆待發送通知（不 commit，隨呼叫端交易一起寫入）"""
+    if not target:
+        return
+    db.session.add(NotificationOutbox(
+        channel=channel, target=target,
+        payload=json.dumps(payload, ensure_ascii=False)))
+
+
+def enqueue_line_multicast(user_ids: list, messages: list):
+    """LINE multicast：每 LINE_MULTICAST_MAX 位收件者一筆 outbox，
+    單一批次失敗只重試該批，已送達的批次不會重複收到"""
+    for i in range(0, len(user_ids), LINE_MULTICAST_MAX):
+        enqueue_notification('line_multicast', 'admins',
+                             {'to': user_ids[i:i + LINE_MULTICAST_MAX], 'messages': messages})
+
+
+def wake_outbox_dispatcher():
+    """交易 commit 後呼叫，讓 dispatcher 立即處理新通知"""
+    _outbox_wakeup.set()
+
+
+def _queue_admin_notify(booking):
+    """管理員通知：flex 只組一次，以單一 multicast 送給所有管理員"""
+    ids = admin_line_ids()
+    if ids:
+        enqueue_line_multicast(ids, [flex_admin_notify(booking)])
+
+
+def queue_booking_confirm_notifications(booking):
+    """預約成立：使用者 LINE、管理員 LINE、Email、SMS"""
+    if booking.line_user_id:
+        enqueue_notification('line', booking.line_user_id,
+                             {'messages': [flex_booking_confirm(booking)]})
+    _queue_admin_notify(booking)
+    if booking.customer_email:
+        enqueue_notification('email', booking.customer_email, {
+            'subject': f'【預約確認】{booking.room.name} – {booking.date}',
+            'html': _booking_email_html(booking)})
+    enqueue_notification('sms', booking.customer_phone,
+                         {'body': _booking_sms_body(booking)})
+
+
+def queue_series_confirm_notifications(series, bookings, conflicts=()):
+    """週期性預約成立：每個管道只送一則摘要，而不是每次預約各送一輪"""
+    text = _series_summary_text(series, bookings, conflicts)
+    if series.line_user_id:
+        enqueue_notification('line', series.line_user_id,
+                             {'messages': [{'type': 'text', 'text': text}]})
+    ids = admin_line_ids()
+    if ids:
+        enqueue_line_multicast(ids, [
+            {'type': 'text', 'text': f'{text}\n預約人：{series.customer_name} {series.customer_phone}'}])
+    if series.customer_email:
+        enqueue_notification('email', series.customer_email, {
+            'subject': f'【週期預約確認】{series.room.name} – 共 {len(bookings)} 次',
+            'html': _series_email_html(series, bookings, conflicts)})
+    enqueue_notification('sms', series.customer_phone, {'body': text})
+
+
+def queue_booking_cancel_notifications(booking, notify_admins=False):
+    """預約取消：使用者 LINE、Email、SMS（使用者自行取消時另通知管理員）"""
+    if booking.line_user_id:
+        enqueue_notification('line', booking.line_user_id,
+                             {'messages': [flex_booking_cancel(booking)]})
+    if notify_admins:
+        _queue_admin_notify(booking)
+        return
+    if booking.customer_email:
+        enqueue_notification('email', booking.customer_email, {
+            'subject': f'【預約取消】{booking.room.name if booking.room else ""} – {booking.date}',
+            'html': _cancel_email_html(booking)})
+    enqueue_notification('sms', booking.customer_phone,
+                         {'body': _cancel_sms_body(booking)})
+
+
+def _deliver_notification(channel: str, target: str, payload: str) -> bool:
+    p = json.loads(payload)
+    if channel == 'line':
+        return push_line(target, p['messages'])
+    if channel == 'line_multicast':
+        # 新資料每筆一個批次；舊資料可能含多批，仍逐批送出
+        ok = True
+        for i in range(0, len(p['to']), LINE_MULTICAST_MAX):
+            ok = multicast_line(p['to'][i:i + LINE_MULTICAST_MAX], p['messages'])[0] and ok
+        return ok
+    if channel == 'email':
+        return send_email(target, p['subject'], p['html'])
+    if channel == 'sms':
+        return send_sms(target, p['body'])
+    print(f'[outbox] 未知的通知管道：{channel}')
     return True
 
 
-def check_segments_availability(room_id, date, segments, exclude_id=None):
-    """檢查多段時段是否全部可用"""
-    for seg in segments:
-        if not check_availability(room_id, date, seg['start'], seg['end'], exclude_id):
-            return False, seg
-    return True, None
+def _claim_outbox_batch(limit: int) -> list:
+    """領取一批到期的通知（條件式 UPDATE，多個 worker 同時執行也不會重複領取）"""
+    now = tw_now()
+    stale = now - timedelta(seconds=OUTBOX_STALE_SECONDS)
+    candidates = NotificationOutbox.query.filter(
+        ((NotificationOutbox.status == 'pending') &
+         (NotificationOutbox.next_attempt_at <= now)) |
+        ((NotificationOutbox.status == 'sending') &
+         (NotificationOutbox.claimed_at < stale))
+    ).order_by(NotificationOutbox.id).limit(limit).all()
+    claimed = []
+    for row in candidates:
+        n = NotificationOutbox.query.filter_by(id=row.id, status=row.status).filter(
+            (NotificationOutbox.claimed_at.is_(None)) |
+            (NotificationOutbox.claimed_at == row.claimed_at)
+        ).update({'status': 'sending', 'claimed_at': now}, synchronize_session=False)
+        if n:
+            claimed.append((row.id, row.channel, row.target, row.payload, row.attempts or 0))
+    db.session.commit()
+    return claimed
+
+
+def dispatch_outbox(pool, limit: int = 50) -> int:
+    """發送一批通知並記錄結果，回傳處理筆數"""
+    claimed = _claim_outbox_batch(limit)
+    if not claimed:
+        return 0
+    futures = [(row, pool.submit(_deliver_notification, row[1], row[2], row[3]))
+               for row in claimed]
+    for (oid, channel, target, _, attempts), fut in futures:
+        try:
+            ok, error = fut.result(), ''
+        except Exception as e:
+            ok, error = False, f'{type(e).__name__}: {e}'
+        attempts += 1
+        if ok:
+            values = {'status': 'sent', 'attempts': attempts, 'sent_at': tw_now()}
+        elif attempts >= OUTBOX_MAX_ATTEMPTS:
+            values = {'status': 'failed', 'attempts': attempts,
+                      'last_error': error[:300] or 'send failed'}
+            print(f'[outbox] #{oid} {channel} → {target} 放棄重試')
+        else:
+            backoff = 30 * (2 ** (attempts - 1))   # 30s, 60s, 120s, 240s
+            values = {'status': 'pending', 'attempts': attempts,
+                      'claimed_at': None,
+                      'next_attempt_at': tw_now() + timedelta(seconds=backoff),
+                      'last_error': error[:300] or 'send failed'}
+        NotificationOutbox.query.filter_by(id=oid).update(values, synchronize_session=False)
+    db.session.commit()
+    return len(claimed)
+
+
+def run_outbox_dispatcher(stop_event=None):
+    """dispatcher 主迴圈：有新通知立即處理，否則每 OUTBOX_POLL_SECONDS 輪詢一次"""
+    with ThreadPoolExecutor(max_workers=OUTBOX_WORKERS,
+                            thread_name_prefix='outbox') as pool:
+        while not (stop_event and stop_event.is_set()):
+            processed = 0
+            with app.app_context():
+                try:
+                    processed = dispatch_outbox(pool)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f'[outbox] dispatch error: {type(e).__name__}: {e}')
+                finally:
+                    db.session.remove()
+            if not processed:
+                _outbox_wakeup.wait(OUTBOX_POLL_SECONDS)
+                _outbox_wakeup.clear()
+
+
+_outbox_started = False
+_outbox_start_lock = threading.Lock()
+
+
+def start_outbox_dispatcher():
+    """每個行程只啟動一次 dispatcher thread（thread 模式）"""
+    global _outbox_started
+    if OUTBOX_DISPATCHER != 'thread' or _outbox_started:
+        return
+    with _outbox_start_lock:
+        if _outbox_started:
+            return
+        _outbox_started = True
+        t = threading.Thread(target=run_outbox_dispatcher, name='outbox-dispatcher', daemon=True)
+        t.start()
+
+
+@app.before_request
+def _ensure_outbox_dispatcher():
+    # 收到第一個請求才啟動：flask migrate / bench-indexes / shell 等 CLI 行程不處理請求，
+    # 不會在其中送出通知；gunicorn 也是在 fork 後的 worker 內才啟動
+    start_outbox_dispatcher()
 
 
-def get_booked_slots(room_id, date):
-    import json as _json
-    bookings = Booking.query.filter_by(room_id=room_id, date=date).filter(
-        Booking.status.in_(['confirmed', 'completed'])).all()
-    result = []
-    for b in bookings:
-        segs = []
-        if b.segments:
-            try: segs = _json.loads(b.segments)
-            except Exception: pass
-        if not segs:
-            segs = [{'start': b.start_time, 'end': b.end_time}]
-        for seg in segs:
-            result.append({'start': seg['start'], 'end': seg['end'],
-                           'booking_number': b.booking_number})
-    # 加入封鎖時段（全館 + 指定房間）
-    blocked = BlockedSlot.query.filter_by(date=date).filter(
-        (BlockedSlot.room_id == room_id) | (BlockedSlot.room_id.is_(None))
-    ).all()
-    for bl in blocked:
-        result.append({'start': bl.start_time, 'end': bl.end_time,
-                       'blocked': True, 'reason': bl.reason or '不開放'})
-    return result
+@app.cli.command('outbox-worker')
+def outbox_worker_command():
+    """獨立執行通知 dispatcher（搭配 OUTBOX_DISPATCHER=off）"""
+    print('[outbox] worker started')
+    run_outbox_dispatcher()
 
 
-def admin_line_ids():
-    return [u.line_user_id for u in LineUser.query.filter_by(is_admin=True).all()]
+@app.cli.command('rebuild-daily-stats')
+def rebuild_daily_stats_command():
+    """由 bookings 全量重建 booking_daily_stats（修正彙總表偏差用）"""
+    print(f'[stats] rebuilt {rebuild_daily_stats()} rows')
 
 
-def upsert_line_user(user_id, display_name=''):
-    lu = LineUser.query.filter_by(line_user_id=user_id).first()
-    if not lu:
-        lu = LineUser(line_user_id=user_id, display_name=display_name)
-        db.session.add(lu)
-        db.session.commit()
-    return lu
+# ─────────────────────────────────────────────
+# Indexes
+# ─────────────────────────────────────────────
+
+def ensure_indexes(bind):
+    """補建模型宣告但資料庫尚未存在的索引（create_all 不會替既有資料表加索引）。
+    以 CREATE INDEX IF NOT EXISTS 執行，多個 worker 同時啟動也不會互相衝突。"""
+    from sqlalchemy.schema import CreateIndex
+    inspector = db.inspect(bind)
+    tables = set(inspector.get_table_names())
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        have = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for ix in table.indexes:
+            if ix.info.get('dialect', bind.dialect.name) != bind.dialect.name:
+                continue   # 限定其他資料庫的索引（_dialect_index）
+            if ix.name not in have:
+                bind.execute(CreateIndex(ix, if_not_exists=True))
+                created.append(ix.name)
+    return created
+
+
+# 熱門查詢：(名稱, SQL, 參數)；bench-indexes 以此比較加索引前後的查詢計畫
+_HOT_QUERIES = [
+    # 與 _active_segments_query + check_availability 相同：booking_segments JOIN bookings
+    ('衝突檢查 booking_segments',
+     "SELECT bs.start_min, bs.end_min FROM booking_segments bs "
+     "JOIN bookings b ON bs.booking_id = b.id "
+     "WHERE bs.room_id = :rid AND bs.date = :d AND b.status IN ('confirmed', 'completed') "
+     "AND bs.start_min < :e AND bs.end_min > :s LIMIT 1",
+     {'rid': 3, 'd': '2026-03-15', 's': 600, 'e': 660}),
+    ('後台篩選 room+date+status',
+     "SELECT id FROM bookings WHERE room_id = :rid AND date = :d "
+     "AND status IN ('confirmed', 'completed')",
+     {'rid': 3, 'd': '2026-03-15'}),
+    ('我的預約 line_user_id',
+     "SELECT id FROM bookings WHERE line_user_id = :uid ORDER BY created_at DESC LIMIT 10",
+     {'uid': 'U00000042'}),
+    ('我的預約 customer_phone',
+     "SELECT id FROM bookings WHERE customer_phone = :ph ORDER BY created_at DESC LIMIT 10",
+     {'ph': '0900000042'}),
+    ('後台列表 keyset',
+     "SELECT id FROM bookings ORDER BY created_at DESC NULLS LAST, id DESC LIMIT 50", {}),
+    ('封鎖時段 date+room',
+     "SELECT id FROM blocked_slots WHERE date BETWEEN :d1 AND :d2 AND room_id = :rid",
+     {'d1': '2026-03-01', 'd2': '2026-03-31', 'rid': 3}),
+    ('LINE 使用者 phone',
+     "SELECT id FROM line_users WHERE phone = :ph", {'ph': '0900000042'}),
+    ('LINE 管理員 is_admin',
+     "SELECT line_user_id FROM line_users WHERE is_admin = :t", {'t': True}),
+    ('登入紀錄 login_at',
+     "SELECT id FROM admin_login_logs ORDER BY login_at DESC LIMIT 50", {}),
+]
+
+
+def _explain(conn, sql, params):
+    """回傳查詢計畫文字與實際執行毫秒數"""
+    import time
+    stmt = db.text(sql).bindparams(**params)
+    literal = str(stmt.compile(conn, compile_kwargs={'literal_binds': True}))
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    plan = [' | '.join(str(v) for v in r) for r in conn.execute(db.text(prefix + literal))]
+    t0 = time.perf_counter()
+    conn.execute(stmt).fetchall()
+    return plan, (time.perf_counter() - t0) * 1000
+
+
+def _seed_bench(conn, rows):
+    """寫入 rows 筆假預約與其 booking_segments（以及比例相應的封鎖時段 / LINE 使用者 / 登入紀錄）"""
+    import random
+    rnd = random.Random(2026)
+    base = datetime(2025, 1, 1)
+    conn.execute(db.insert(Room), [{'id': i, 'name': f'bench-{i}', 'room_type': 'bench'}
+                                   for i in range(1, 21)])
+    batch, segs = [], []
+    for i in range(1, rows + 1):
+        day = base + timedelta(days=rnd.randrange(730))
+        h = rnd.randrange(8, 20)
+        n = rnd.randrange(5000)
+        rid = rnd.randrange(1, 21)
+        batch.append({
+            'id': i, 'booking_number': f'B{i:09d}', 'room_id': rid,
+            'customer_name': f'客戶{n}', 'customer_phone': f'09{n:08d}',
+            'date': day.strftime('%Y-%m-%d'),
+            'start_time': f'{h:02d}:00', 'end_time': f'{h + 1:02d}:00',
+            'status': 'cancelled' if rnd.random() < 0.1 else 'confirmed',
+            'line_user_id': f'U{n:08d}' if rnd.random() < 0.6 else None,
+            'created_at': day - timedelta(days=rnd.randrange(30), minutes=rnd.randrange(1440)),
+        })
+        segs.append({'booking_id': i, 'room_id': rid, 'date': batch[-1]['date'],
+                     'start_min': h * 60, 'end_min': h * 60 + 60})
+        if len(batch) >= 10000:
+            conn.execute(db.insert(Booking), batch)
+            conn.execute(db.insert(BookingSegment), segs)
+            batch, segs = [], []
+    if batch:
+        conn.execute(db.insert(Booking), batch)
+        conn.execute(db.insert(BookingSegment), segs)
+    aux = max(rows // 50, 100)
+    conn.execute(db.insert(BlockedSlot), [{
+        'room_id': rnd.randrange(1, 21),
+        'date': (base + timedelta(days=rnd.randrange(730))).strftime('%Y-%m-%d'),
+        'start_time': '12:00', 'end_time': '13:00'} for _ in range(aux)])
+    conn.execute(db.insert(LineUser), [{
+        'line_user_id': f'U{i:08d}', 'phone': f'09{i:08d}', 'is_admin': i % 1000 == 0}
+        for i in range(aux)])
+    conn.execute(db.insert(AdminLoginLog), [{
+        'username': 'admin', 'login_at': base + timedelta(minutes=i * 7)}
+        for i in range(aux)])
+
+
+@app.cli.command('bench-indexes')
+@click.option('--rows', default=1_000_000, show_default=True, help='假預約筆數')
+@click.option('--url', default='sqlite:///bench_indexes.db', show_default=True,
+              help='測試用資料庫（會清空重建，請勿指向正式資料庫）')
+def bench_indexes_command(rows, url):
+    """在獨立資料庫灌入假資料，比較熱門查詢加索引前後的查詢計畫與耗時"""
+    from sqlalchemy import create_engine
+    engine = create_engine(url)
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    hot = [ix for t in ('bookings', 'booking_segments', 'blocked_slots',
+                        'line_users', 'admin_login_logs')
+           for ix in db.metadata.tables[t].indexes]
+    with engine.begin() as conn:
+        for ix in hot:
+            ix.drop(conn)
+        print(f'[bench] seeding {rows} bookings ...')
+        _seed_bench(conn, rows)
+    for label, create in (('無索引', False), ('有索引', True)):
+        with engine.begin() as conn:
+            if create:
+                print(f'[bench] 建立索引：{", ".join(ensure_indexes(conn))}')
+            if conn.dialect.name == 'postgresql':
+                conn.execute(db.text('ANALYZE'))
+            print(f'\n===== {label} =====')
+            for name, sql, params in _HOT_QUERIES:
+                plan, ms = _explain(conn, sql, params)
+                print(f'-- {name}: {ms:.1f} ms')
+                for line in plan:
+                    print(f'   {line}')
+    engine.dispose()
 
 
 # ─────────────────────────────────────────────
@@ -1613,15 +3009,21 @@ def get_site_content():
             'step1_title','step2_title','step3_title',
             'service_hours','contact_phone','contact_email','footer_text',
             'notice_1','notice_2','notice_3','notice_4','notice_5','logo_url']
-    data = {k: SiteContent.get(k) for k in keys}
-    # form_fields：若未設定則回傳預設值
-    data['form_fields'] = SiteContent.get('form_fields') or """[{\"id\": \"name\", \"label\": \"聯絡人姓名\", \"type\": \"text\", \"placeholder\": \"請輸入姓名\", \"required\": true, \"system\": true, \"full\": false}, {\"id\": \"phone\", \"label\": \"手機號碼\", \"type\": \"tel\", \"placeholder\": \"0912345678\", \"required\": true, \"system\": true, \"full\": false}, {\"id\": \"email\", \"label\": \"Email\", \"type\": \"email\", \"placeholder\": \"your@email.com\", \"required\": true, \"system\": true, \"full\": false, \"hint\": \"必填，接收確認信\"}, {\"id\": \"department\", \"label\": \"部門／公司\", \"type\": \"text\", \"placeholder\": \"例：行銷部\", \"required\": false, \"system\": true, \"full\": false}, {\"id\": \"attendees\", \"label\": \"預計出席人數\", \"type\": \"select\", \"options\": \"1,2,3,4,5,6,8,10,15,20,30,50\", \"required\": false, \"system\": true, \"full\": false}, {\"id\": \"purpose\", \"label\": \"會議類型\", \"type\": \"select\", \"options\": \"部門會議,客戶洽談,員工培訓,產品發表,視訊會議,腦力激盪,其他\", \"required\": false, \"system\": true, \"full\": false}, {\"id\": \"note\", \"label\": \"備註\", \"type\": \"textarea\", \"placeholder\": \"特殊需求或注意事項...\", \"required\": false, \"system\": true, \"full\": true}]"""
-    return jsonify(data)
+    def build():
+        data = {k: SiteContent.get(k) for k in keys}
+        # form_fields：若未設定則回傳預設值
+        data['form_fields'] = SiteContent.get('form_fields') or DEFAULT_FORM_FIELDS
+        return data
+    return cached_json_response('site_content', build)
+
+
+DEFAULT_FORM_FIELDS = """[{\"id\": \"name\", \"label\": \"聯絡人姓名\", \"type\": \"text\", \"placeholder\": \"請輸入姓名\", \"required\": true, \"system\": true, \"full\": false}, {\"id\": \"phone\", \"label\": \"手機號碼\", \"type\": \"tel\", \"placeholder\": \"0912345678\", \"required\": true, \"system\": true, \"full\": false}, {\"id\": \"email\", \"label\": \"Email\", \"type\": \"email\", \"placeholder\": \"your@email.com\", \"required\": true, \"system\": true, \"full\": false, \"hint\": \"必填，接收確認信\"}, {\"id\": \"department\", \"label\": \"部門／公司\", \"type\": \"text\", \"placeholder\": \"例：行銷部\", \"required\": false, \"system\": true, \"full\": false}, {\"id\": \"attendees\", \"label\": \"預計出席人數\", \"type\": \"select\", \"options\": \"1,2,3,4,5,6,8,10,15,20,30,50\", \"required\": false, \"system\": true, \"full\": false}, {\"id\": \"purpose\", \"label\": \"會議類型\", \"type\": \"select\", \"options\": \"部門會議,客戶洽談,員工培訓,產品發表,視訊會議,腦力激盪,其他\", \"required\": false, \"system\": true, \"full\": false}, {\"id\": \"note\", \"label\": \"備註\", \"type\": \"textarea\", \"placeholder\": \"特殊需求或注意事項...\", \"required\": false, \"system\": true, \"full\": true}]"""
 
 
 @app.route('/api/rooms')
 def get_rooms():
-    return jsonify([r.to_dict() for r in Room.query.filter_by(is_active=True).all()])
+    return cached_json_response(
+        'rooms', lambda: [r.to_dict() for r in Room.query.filter_by(is_active=True).all()])
 
 
 @app.route('/api/rooms/<int:room_id>/availability')
@@ -1629,7 +3031,120 @@ def room_availability(room_id):
     date = request.args.get('date')
     if not date:
         return jsonify({'error': 'Missing date'}), 400
-    return jsonify({'booked_slots': get_booked_slots(room_id, date)})
+    booked = get_booked_slots(room_id, date)
+    grid = SlotGrid.from_slots(booked)
+    return jsonify({'booked_slots': booked, 'slots': grid.to_list(),
+                    'day_start': _fmt_min(grid.day_start), 'day_end': _fmt_min(grid.day_end),
+                    'slot_minutes': grid.slot})
+
+
+@app.route('/api/availability')
+def bulk_availability():
+    """多間會議室 / 多日的已預約時段（取代逐間呼叫 /api/rooms/<id>/availability）
+
+    參數：date=YYYY-MM-DD 或 from=YYYY-MM-DD&to=YYYY-MM-DD（最多 31 天），
+         room_ids=1,2,3（選填，預設所有啟用中的會議室）
+    """
+    date_from = request.args.get('from') or request.args.get('date')
+    date_to   = request.args.get('to') or date_from
+    if not date_from:
+        return jsonify({'error': 'Missing date'}), 400
+    try:
+        d0 = datetime.strptime(date_from, '%Y-%m-%d')
+        d1 = datetime.strptime(date_to, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': '日期格式錯誤，請使用 YYYY-MM-DD'}), 400
+    if d1 < d0 or (d1 - d0).days > 30:
+        return jsonify({'error': '日期區間需在 31 天以內'}), 400
+    room_ids = None
+    if v := request.args.get('room_ids'):
+        try:
+            room_ids = [int(x) for x in v.split(',') if x.strip()]
+        except ValueError:
+            return jsonify({'error': 'room_ids 格式錯誤'}), 400
+    data = get_booked_slots_bulk(date_from, date_to, room_ids)
+    return jsonify({'from': date_from, 'to': date_to,
+                    'rooms': {str(rid): days for rid, days in data.items()}})
+
+
+SEARCH_MAX_DAYS    = 31
+SEARCH_MAX_RESULTS = 200
+
+
+@app.route('/api/search')
+def search_free_slots():
+    """搜尋可預約的 (會議室, 開始時間)，依最早時間、人數最貼近、價格排序
+
+    參數：from=YYYY-MM-DD（必填）、to=YYYY-MM-DD（選填，最多 31 天）、
+         duration=分鐘數（預設 60）、attendees=人數（選填）、amenities=投影機,白板（需全部具備）、
+         earliest=HH:MM / latest=HH:MM（一天中的時段範圍，預設營業時段）、limit（預設 20，最多 200）
+    所有會議室、整段日期的預約與封鎖時段各只查詢一次（floor_grid），再逐格取空閒區段。
+    """
+    date_from = request.args.get('from') or request.args.get('date')
+    date_to   = request.args.get('to') or date_from
+    if not date_from:
+        return jsonify({'error': 'Missing from'}), 400
+    try:
+        d0 = datetime.strptime(date_from, '%Y-%m-%d')
+        d1 = datetime.strptime(date_to, '%Y-%m-%d')
+        duration  = int(request.args.get('duration', 60))
+        attendees = int(request.args.get('attendees', 0))
+        earliest  = _to_min(request.args.get('earliest', _fmt_min(SLOT_DAY_START)))
+        latest    = _to_min(request.args.get('latest', _fmt_min(SLOT_DAY_END)))
+        limit     = max(1, min(int(request.args.get('limit', 20)), SEARCH_MAX_RESULTS))
+    except ValueError:
+        return jsonify({'error': '參數格式錯誤'}), 400
+    if d1 < d0 or (d1 - d0).days >= SEARCH_MAX_DAYS:
+        return jsonify({'error': f'日期區間需在 {SEARCH_MAX_DAYS} 天以內'}), 400
+    earliest, latest = max(earliest, SLOT_DAY_START), min(latest, SLOT_DAY_END)
+    if duration <= 0 or latest - earliest < duration:
+        return jsonify({'error': '時段範圍不足以容納預約時長'}), 400
+    wanted = [a.strip() for a in request.args.get('amenities', '').split(',') if a.strip()]
+
+    q = Room.query.filter_by(is_active=True)
+    if attendees:
+        q = q.filter(Room.capacity >= attendees,
+                     func.coalesce(Room.capacity_min, 0) <= attendees)
+    rooms = []
+    for r in q.all():
+        if float(r.min_hours or 1.0) * 60 > duration:
+            continue
+        if wanted:
+            have = set(json.loads(r.amenities) if r.amenities else [])
+            if not have.issuperset(wanted):
+                continue
+        rooms.append(r)
+    if not rooms:
+        return jsonify({'candidates': [], 'count': 0})
+
+    # 時段格只涵蓋 earliest–latest，空閒區段因此已限定在使用者指定的時段內
+    window = {'day_start': earliest, 'day_end': latest}
+    grids = floor_grid([r.id for r in rooms], date_from, date_to, slot=SLOT_MINUTES, **window)
+    now = tw_now()
+    today = now.strftime('%Y-%m-%d')
+    now_min = now.hour * 60 + now.minute
+    empty = SlotGrid(slot=SLOT_MINUTES, **window)
+
+    candidates = []
+    for i in range((d1 - d0).days + 1):
+        d = (d0 + timedelta(days=i)).strftime('%Y-%m-%d')
+        if d < today:
+            continue
+        for r in rooms:
+            cell = grids[r.id].get(d)
+            for start, end in (cell['grid'] if cell else empty).free_ranges():
+                if d == today and start < now_min:
+                    start = earliest + -(-(now_min - earliest) // SLOT_MINUTES) * SLOT_MINUTES
+                if start + duration > end:
+                    continue
+                candidates.append((d, start, r.capacity - attendees, r.hourly_rate, r))
+    candidates.sort(key=lambda c: c[:4])
+    return jsonify({'count': len(candidates), 'candidates': [{
+        'room_id': r.id, 'room_name': r.name, 'room_type': r.room_type,
+        'floor': r.floor or '', 'capacity': r.capacity,
+        'date': d, 'start': _fmt_min(start), 'end': _fmt_min(start + duration),
+        'price': int(duration / 60 * r.hourly_rate),
+    } for d, start, _, _, r in candidates[:limit]]})
 
 
 @app.route('/api/line/bind-profile', methods=['POST'])
@@ -1668,7 +3183,7 @@ def create_booking():
         if segments and len(segments) > 0:
             ok, conflict = check_segments_availability(room.id, data['date'], segments)
             if not ok:
-                return jsonify({'error': f'時段 {conflict["start"]}–{conflict["end"]} 已被預約，請選擇其他時間'}), 400
+                return jsonify({'error': f'時段 {conflict["start"]}–{conflict["end"]} 已被預約，請選擇其他時間'}), 409
             def _m(t):
                 h, mn = map(int, t.split(':'))
                 return h * 60 + mn
@@ -1688,7 +3203,7 @@ def create_booking():
             # 單段時段（向下相容）
             segments = None
             if not check_availability(room.id, data['date'], data['start_time'], data['end_time']):
-                return jsonify({'error': '此時段已被預約，請選擇其他時間'}), 400
+                return jsonify({'error': '此時段已被預約，請選擇其他時間'}), 409
             def _m(t):
                 h, mn = map(int, t.split(':'))
                 return h * 60 + mn
@@ -1732,24 +3247,13 @@ def create_booking():
             note           = data.get('note', ''),
             line_user_id   = line_uid,
         )
-        db.session.add(booking)
-        db.session.commit()
+        # 鎖定 (room, date) 後再做最終衝突檢查，避免多 worker 同時搶同一時段
+        # 通知寫入 outbox 與預約同一交易，由背景 dispatcher 發送
+        ok, conflict = reserve_booking(booking, queue_booking_confirm_notifications)
+        if not ok:
+            return jsonify({'error': f'時段 {conflict["start"]}–{conflict["end"]} 已被預約，請選擇其他時間'}), 409
         booking = Booking.query.get(booking.id)
 
-        # 通知（失敗不影響預約成立）
-        try:
-            if booking.line_user_id:
-                push_line(booking.line_user_id, [flex_booking_confirm(booking)])
-            for aid in admin_line_ids():
-                push_line(aid, [flex_admin_notify(booking)])
-            if booking.customer_email:
-                send_email(booking.customer_email,
-                           f'【預約確認】{booking.room.name} – {booking.date}',
-                           _booking_email_html(booking))
-            send_sms(booking.customer_phone, _booking_sms_body(booking))
-        except Exception as ne:
-            print(f'[通知錯誤] {ne}')
-
         return jsonify({'success': True, 'booking': booking.to_dict()}), 201
 
     except Exception as e:
@@ -1758,6 +3262,126 @@ def create_booking():
         import traceback; traceback.print_exc()
         return jsonify({'error': f'預約失敗，請稍後再試（{type(e).__name__}）'}), 500
 
+@app.route('/api/book/series', methods=['POST'])
+def create_booking_series():
+    """建立週期性預約
+
+    欄位同 /api/book（單段 start_time / end_time），另加
+    recurrence：RRULE 字串或 {'freq': 'weekly'|'biweekly'|'monthly', 'count' | 'until'}，
+    skip_conflicts：true 時略過衝突日期只預約可用的日期；預設任一衝突即整批不預約。
+    各次日期的預約 / 封鎖時段一次查詢，整批在同一交易寫入，通知只送一則摘要。
+    """
+    try:
+        return _create_booking_series(request.get_json() or {})
+    except Exception as e:
+        db.session.rollback()
+        print(f'[create_booking_series error] {type(e).__name__}: {e}')
+        return jsonify({'error': f'預約失敗，請稍後再試（{type(e).__name__}）'}), 500
+
+
+def _create_booking_series(data):
+    room = Room.query.get(data.get('room_id'))
+    if not room:
+        return jsonify({'error': '找不到此會議室'}), 404
+    for k, label in (('name', '聯絡人姓名'), ('phone', '手機號碼'), ('email', 'Email')):
+        if not str(data.get(k, '')).strip():
+            return jsonify({'error': f'請填寫{label}'}), 400
+    for k in ('date', 'start_time', 'end_time'):
+        if not data.get(k):
+            return jsonify({'error': f'缺少欄位 {k}'}), 400
+    try:
+        first_date = datetime.strptime(str(data['date']), '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        return jsonify({'error': '日期格式需為 YYYY-MM-DD'}), 400
+    try:
+        start_min, end_min = _to_min(str(data['start_time'])), _to_min(str(data['end_time']))
+    except ValueError:
+        return jsonify({'error': '時間格式需為 HH:MM'}), 400
+    if not 0 <= start_min < 24 * 60 or not 0 < end_min <= 24 * 60:
+        return jsonify({'error': '時間格式需為 HH:MM'}), 400
+    start_time, end_time = _fmt_min(start_min), _fmt_min(end_min)
+    dur = (end_min - start_min) / 60
+    try:
+        # parse_recurrence / expand_recurrence 的 ValueError 皆為中文訊息
+        rule = parse_recurrence(data.get('recurrence'))
+        dates = expand_recurrence(first_date, rule)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not dates:
+        return jsonify({'error': '沒有符合重複規則的日期'}), 400
+    if dur <= 0:
+        return jsonify({'error': '結束時間需晚於開始時間'}), 400
+    min_h = float(room.min_hours or 1.0)
+    if min_h > 0 and dur < min_h:
+        min_disp = int(min_h) if min_h == int(min_h) else min_h
+        return jsonify({'error': f'此會議室每次最少預約 {min_disp} 小時'}), 400
+    if dates[0] < tw_now().strftime('%Y-%m-%d'):
+        return jsonify({'error': '不能選擇過去的日期'}), 400
+    skip_conflicts = bool(data.get('skip_conflicts'))
+
+    def _check(occ, candidates):
+        free = [d for d in candidates if occ[d].is_free(start_time, end_time)]
+        taken = set(free)
+        return free, [d for d in dates if d not in taken]
+
+    def _conflict_response(conflicts):
+        return jsonify({'error': f'{len(conflicts)} 個日期時段已被預約',
+                        'conflicts': [{'date': d, 'start': start_time, 'end': end_time}
+                                      for d in conflicts],
+                        'occurrences': dates}), 409
+
+    # 先不鎖定做一次檢查，確定要預約的日期後再一次配發編號（配發使用獨立連線）
+    free, conflicts = _check(load_occupancy_range(room.id, dates), dates)
+    if (conflicts and not skip_conflicts) or not free:
+        return _conflict_response(conflicts)
+    numbers = generate_booking_numbers(len(free))
+
+    line_uid = data.get('line_user_id', '')
+    if not line_uid:
+        lu = LineUser.query.filter_by(phone=data['phone']).first()
+        if lu:
+            line_uid = lu.line_user_id
+    try:
+        # 依日期順序鎖定各 (room, date)，鎖內重新檢查後整批寫入（只預約已配發編號的日期）
+        for d in free:
+            acquire_slot_lock(room.id, d)
+        free, conflicts = _check(load_occupancy_range(room.id, free), free)
+        if (conflicts and not skip_conflicts) or not free:
+            db.session.rollback()
+            return _conflict_response(conflicts)
+        series = BookingSeries(
+            room_id=room.id, rule=recurrence_rule_str(rule),
+            start_time=start_time, end_time=end_time,
+            first_date=free[0], last_date=free[-1],
+            customer_name=data['name'], customer_phone=data['phone'],
+            customer_email=data.get('email', ''), line_user_id=line_uid)
+        db.session.add(series)
+        bookings = []
+        for d, number in zip(free, numbers):
+            b = Booking(
+                booking_number=number, room_id=room.id, series=series,
+                customer_name=data['name'], customer_phone=data['phone'],
+                customer_email=data.get('email', ''), department=data.get('department', ''),
+                date=d, start_time=start_time, end_time=end_time, duration=dur,
+                total_price=int(dur * room.hourly_rate),
+                attendees=data.get('attendees', 1), purpose=data.get('purpose', ''),
+                note=data.get('note', ''), line_user_id=line_uid)
+            b.sync_segments()
+            bookings.append(b)
+        db.session.add_all(bookings)
+        db.session.flush()
+        queue_series_confirm_notifications(series, bookings, conflicts)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f'[create_booking_series error] {type(e).__name__}: {e}')
+        return jsonify({'error': f'預約失敗，請稍後再試（{type(e).__name__}）'}), 500
+    wake_outbox_dispatcher()
+    return jsonify({'success': True, 'series': series.to_dict(),
+                    'conflicts': [{'date': d, 'start': start_time, 'end': end_time}
+                                  for d in conflicts]}), 201
+
+
 @app.route('/api/bookings/check')
 def check_booking():
     number = request.args.get('number')
@@ -1924,7 +3548,7 @@ def flex_input_date(room_name: str) -> dict:
 
 
 def flex_select_slot(room_name: str, date_str: str,
-                     booked: list, room_id: int) -> dict:
+                     grid: SlotGrid, room_id: int) -> dict:
     """Step 3：選擇時段（顯示可用 / 已占用）"""
     from datetime import datetime as _dt
     try:
@@ -1934,24 +3558,12 @@ def flex_select_slot(room_name: str, date_str: str,
     except Exception:
         date_fmt = date_str
 
-    # 把已占用時段展開成 slot set
-    blocked = set()
-    for b in booked:
-        sh, sm = map(int, b['start'].split(':'))
-        eh, em = map(int, b['end'].split(':'))
-        s_idx = (sh * 60 + sm - 8 * 60) // 30
-        e_idx = (eh * 60 + em - 8 * 60) // 30
-        for i in range(s_idx, e_idx):
-            blocked.add(i)
-
-    # 產生時段按鈕（以小時為單位，8:00~22:00 = 14 個整點）
+    # 產生時段按鈕（以小時為單位，涵蓋整個營業時段）
     slot_rows = []
-    for h in range(8, 21):
-        s_idx = (h - 8) * 2
-        e_idx = s_idx + 2
-        is_blocked = any(i in blocked for i in range(s_idx, e_idx))
-        start_t = f'{h:02d}:00'
-        end_t   = f'{h+1:02d}:00'
+    for start in range(grid.day_start, grid.day_end - 59, 60):
+        is_blocked = not grid.is_free(start, start + 60)
+        start_t = _fmt_min(start)
+        end_t   = _fmt_min(start + 60)
         label   = f'{start_t} – {end_t}'
         if is_blocked:
             slot_rows.append({
@@ -2233,29 +3845,29 @@ def _handle_booking_flow(uid: str, rtok: str, text: str, lu):
             reply_line(rtok, [flex_input_date(sess.get('room_name', ''))])
             return True
 
-        booked = get_booked_slots(sess['room_id'], date_str)
+        grid = load_slot_grid(sess['room_id'], date_str)
         sess['step']  = 'select_slot'
         sess['date']  = date_str
         _save_sess(lu, sess)
         reply_line(rtok, [flex_select_slot(
-            sess['room_name'], date_str, booked, sess['room_id'])])
+            sess['room_name'], date_str, grid, sess['room_id'])])
         return True
 
     # ── Step 3：選時段 ──
     if step == 'select_slot':
         m = _re.match(r'^選時段 (\d{2}:\d{2}) (\d{2}:\d{2})$', text)
         if not m:
-            booked = get_booked_slots(sess['room_id'], sess['date'])
+            grid = load_slot_grid(sess['room_id'], sess['date'])
             reply_line(rtok, [flex_select_slot(
-                sess['room_name'], sess['date'], booked, sess['room_id'])])
+                sess['room_name'], sess['date'], grid, sess['room_id'])])
             return True
         start_t, end_t = m.group(1), m.group(2)
         # 即時衝突檢查
         if not check_availability(sess['room_id'], sess['date'], start_t, end_t):
-            booked = get_booked_slots(sess['room_id'], sess['date'])
+            grid = load_slot_grid(sess['room_id'], sess['date'])
             reply_line(rtok, [
                 flex_not_found('此時段已被預約', '請選擇其他時段'),
-                flex_select_slot(sess['room_name'], sess['date'], booked, sess['room_id'])
+                flex_select_slot(sess['room_name'], sess['date'], grid, sess['room_id'])
             ])
             return True
         sess['step']       = 'input_name'
@@ -2309,15 +3921,6 @@ def _handle_booking_flow(uid: str, rtok: str, text: str, lu):
 
     # ── Step 5：確認送出 ──
     if step == 'confirm' and text == '確認送出預約':
-        # 最終衝突再確認（防止兩人同時搶同一時段）
-        if not check_availability(sess['room_id'], sess['date'],
-                                  sess['start_time'], sess['end_time']):
-            _clear_sess(lu)
-            reply_line(rtok, [flex_not_found(
-                '很抱歉，此時段剛被其他人預約',
-                '請重新開始預約，輸入「預約」繼續')])
-            return True
-
         # 計算費用
         sh, sm = map(int, sess['start_time'].split(':'))
         eh, em = map(int, sess['end_time'].split(':'))
@@ -2342,22 +3945,18 @@ def _handle_booking_flow(uid: str, rtok: str, text: str, lu):
             note            = '',
             line_user_id    = uid,
         )
-        db.session.add(booking)
-        # 綁定手機
+        # 綁定手機：先獨立提交，預約衝突回滾時不會一併遺失
         lu.phone = sess['phone']
         db.session.commit()
-        booking = Booking.query.get(booking.id)
+        # 鎖定 (room, date) 後寫入，防止兩人同時搶同一時段
+        ok, _ = reserve_booking(booking, queue_booking_confirm_notifications)
+        if not ok:
+            _clear_sess(lu)
+            reply_line(rtok, [flex_not_found(
+                '很抱歉，此時段剛被其他人預約',
+                '請重新開始預約，輸入「預約」繼續')])
+            return True
         _clear_sess(lu)
-
-        # 通知
-        push_line(uid, [flex_booking_confirm(booking)])
-        for aid in admin_line_ids():
-            push_line(aid, [flex_admin_notify(booking)])
-        if booking.customer_email:
-            send_email(booking.customer_email,
-                       f'【預約確認】{booking.room.name} – {booking.date}',
-                       _booking_email_html(booking))
-        send_sms(booking.customer_phone, _booking_sms_body(booking))
         return True
 
     return False  # 不在流程中
@@ -2438,10 +4037,9 @@ def _handle_line_text(uid, rtok, text):
                 '請輸入：時段 2026-03-15  或  時段 3/15')])
             return
         rooms = Room.query.filter_by(is_active=True).all()
-        rooms_data = []
-        for room in rooms:
-            slots = get_booked_slots(room.id, date_str)
-            rooms_data.append({'name': room.name, 'slots': slots})
+        booked = get_booked_slots_bulk(date_str, room_ids=[r.id for r in rooms])
+        rooms_data = [{'name': room.name, 'slots': booked[room.id].get(date_str, [])}
+                      for room in rooms]
         reply_line(rtok, [flex_timeslot(date_str, rooms_data)])
         return
 
@@ -2479,10 +4077,9 @@ def _handle_line_text(uid, rtok, text):
         except Exception:
             pass
         b.status = 'cancelled'
+        queue_booking_cancel_notifications(b, notify_admins=True)
         db.session.commit()
-        push_line(uid, [flex_booking_cancel(b)])
-        for aid in admin_line_ids():
-            push_line(aid, [flex_admin_notify(b)])
+        wake_outbox_dispatcher()
         return
 
     # ── 綁定手機 ──
@@ -2576,45 +4173,58 @@ def admin_me():
 
 @app.route('/admin/api/floor-status')
 def admin_floor_status():
+    """樓層占用看板
+
+    參數：date=YYYY-MM-DD，或 from=&to=（最多 31 天，週檢視一次取回）；
+         slot=每格分鐘數、day_start、day_end（預設 SLOT_MINUTES / SLOT_DAY_START / SLOT_DAY_END）。
+    單日回傳 {'date', 'rooms': [...]}（每間含 slots / bookings / blocked）；
+    區間回傳 {'from', 'to', 'rooms': [...]}，每間的 'days' 以日期分組。
+    """
     err = check_admin()
     if err: return err
-    from datetime import datetime as _dt
-    date_str = request.args.get('date', _dt.now().strftime('%Y-%m-%d'))
+    date_from = request.args.get('from') or request.args.get('date') or datetime.now().strftime('%Y-%m-%d')
+    date_to   = request.args.get('to') or date_from
+    try:
+        d0 = datetime.strptime(date_from, '%Y-%m-%d')
+        d1 = datetime.strptime(date_to, '%Y-%m-%d')
+        slot      = int(request.args.get('slot', SLOT_MINUTES))
+        day_start = _to_min(request.args.get('day_start', _fmt_min(SLOT_DAY_START)))
+        day_end   = _to_min(request.args.get('day_end', _fmt_min(SLOT_DAY_END)))
+    except ValueError:
+        return jsonify({'error': '參數格式錯誤'}), 400
+    if d1 < d0 or (d1 - d0).days > 30:
+        return jsonify({'error': '日期區間需在 31 天以內'}), 400
+    if slot < 5 or day_end <= day_start or day_end > 24 * 60:
+        return jsonify({'error': '時段設定錯誤'}), 400
+
     rooms = Room.query.filter_by(is_active=True).order_by(Room.floor, Room.name).all()
+    dates = [(d0 + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((d1 - d0).days + 1)]
+    grids = floor_grid([r.id for r in rooms], date_from, date_to, day_start, day_end, slot)
+    empty = SlotGrid(day_start, day_end, slot)
+    n = empty.n
+
+    def _day(rid, d):
+        cell = grids[rid].get(d) or {'grid': empty, 'bookings': [], 'blocked': []}
+        return {'slots': cell['grid'].to_list(),
+                'blocked_slots': cell['grid'].to_list(blocked_only=True),
+                'bookings': cell['bookings'], 'blocked': cell['blocked']}
+
     result = []
     for r in rooms:
-        import json as _json
-        bookings = Booking.query.filter_by(
-            room_id=r.id, date=date_str).filter(
-            Booking.status.in_(['confirmed', 'completed'])).all()
-        occupied = [False] * 28
-        for b in bookings:
-            # 展開 segments（多段時段）
-            segs = []
-            if b.segments:
-                try: segs = _json.loads(b.segments)
-                except Exception: pass
-            if not segs:
-                segs = [{'start': b.start_time, 'end': b.end_time}]
-            for seg in segs:
-                sh, sm = map(int, seg['start'].split(':'))
-                eh, em = map(int, seg['end'].split(':'))
-                si = (sh * 60 + sm - 480) // 30
-                ei = (eh * 60 + em - 480) // 30
-                for i in range(max(0, si), min(28, ei)):
-                    occupied[i] = True
-        result.append({
-            'id': r.id, 'name': r.name,
-            'floor': r.floor or '未分層',
-            'capacity': r.capacity,
-            'room_type': r.room_type or '',
-            'slots': occupied,
-            'bookings': [{'start': b.start_time, 'end': b.end_time,
-                          'segments': b.segments,
-                          'name': b.customer_name,
-                          'number': b.booking_number} for b in bookings]
-        })
-    return jsonify({'date': date_str, 'rooms': result})
+        info = {'id': r.id, 'name': r.name,
+                'floor': r.floor or '未分層',
+                'capacity': r.capacity,
+                'room_type': r.room_type or ''}
+        if date_from == date_to:
+            info.update(_day(r.id, date_from))
+        else:
+            info['days'] = {d: _day(r.id, d) for d in dates}
+        result.append(info)
+    meta = {'slot_minutes': slot, 'slot_count': n,
+            'day_start': _fmt_min(day_start), 'day_end': _fmt_min(day_end), 'rooms': result}
+    if date_from == date_to:
+        return jsonify({'date': date_from, **meta})
+    return jsonify({'from': date_from, 'to': date_to, 'dates': dates, **meta})
 
 
 @app.route('/admin/api/rooms', methods=['GET'])
@@ -2637,6 +4247,7 @@ def admin_add_room():
              floor=d.get('floor',''), photo_url=d.get('photo_url',''),
              is_active=d.get('is_active', True))
     db.session.add(r)
+    bump_cache_version('rooms')
     db.session.commit()
     return jsonify(r.to_dict()), 201
 
@@ -2652,6 +4263,7 @@ def admin_update_room(rid):
             setattr(room, f, d[f])
     if 'amenities' in d:
         room.amenities = json.dumps(d['amenities'], ensure_ascii=False)
+    bump_cache_version('rooms')
     db.session.commit()
     return jsonify(room.to_dict())
 
@@ -2661,6 +4273,7 @@ def admin_delete_room(rid):
     if err: return err
     room = Room.query.get_or_404(rid)
     room.is_active = False
+    bump_cache_version('rooms')
     db.session.commit()
     return jsonify({'success': True})
 
@@ -2703,6 +4316,7 @@ def admin_add_room_photo(rid):
     photos.append(url)
     r.photos = json.dumps(photos, ensure_ascii=False)
     r.photo_url = r.get_cover()
+    bump_cache_version('rooms')
     db.session.commit()
     return jsonify({'success': True, 'photos': photos, 'cover_index': r.cover_index or 0})
 
@@ -2722,6 +4336,7 @@ def admin_delete_room_photo(rid, idx):
     r.photos = json.dumps(photos, ensure_ascii=False)
     r.cover_index = cover
     r.photo_url = photos[cover] if photos else ''
+    bump_cache_version('rooms')
     db.session.commit()
     return jsonify({'success': True, 'photos': photos, 'cover_index': cover})
 
@@ -2738,6 +4353,7 @@ def admin_set_cover_photo(rid):
         return jsonify({'error': '無效的索引'}), 400
     r.cover_index = idx
     r.photo_url = photos[idx]
+    bump_cache_version('rooms')
     db.session.commit()
     return jsonify({'success': True, 'cover_index': idx})
 
@@ -2762,6 +4378,7 @@ def admin_upload_logo():
         url = f'/static/uploads/{filename}'
     SiteContent.query.filter_by(key='logo_url').delete()
     db.session.add(SiteContent(key='logo_url', value=url))
+    bump_cache_version('site_content')
     db.session.commit()
     return jsonify({'success': True, 'logo_url': url})
 
@@ -2803,7 +4420,7 @@ def _upload_to_cloudinary(file_storage) -> str:
 
     upload_url = f'https://api.cloudinary.com/v1_1/{CLOUDINARY_CLOUD_NAME}/image/upload'
     try:
-        resp = http_requests.post(upload_url, data={
+        resp = http_post(upload_url, data={
             'api_key':   CLOUDINARY_API_KEY,
             'timestamp': timestamp,
             'folder':    folder,
@@ -2821,15 +4438,303 @@ def _upload_to_cloudinary(file_storage) -> str:
 # Admin — Bookings
 # ─────────────────────────────────────────────
 
+BOOKINGS_PAGE_MAX = 500
+
+
+def _encode_booking_cursor(b) -> str:
+    raw = f'{b.created_at.isoformat() if b.created_at else ""}|{b.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_booking_cursor(cursor: str):
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    ts, bid = raw.rsplit('|', 1)
+    return (datetime.fromisoformat(ts) if ts else None), int(bid)
+
+
+def _booking_filter_clauses():
+    """預約列表 / 匯出共用的篩選條件：date / date_from / date_to / status / room_id"""
+    clauses = []
+    if v := request.args.get('date'):      clauses.append(Booking.date == v)
+    if v := request.args.get('date_from'): clauses.append(Booking.date >= v)
+    if v := request.args.get('date_to'):   clauses.append(Booking.date <= v)
+    if v := request.args.get('status'):    clauses.append(Booking.status == v)
+    if v := request.args.get('room_id'):   clauses.append(Booking.room_id == int(v))
+    return clauses
+
+
 @app.route('/admin/api/bookings', methods=['GET'])
 def admin_get_bookings():
+    """預約列表（由新到舊）
+
+    篩選：date / date_from / date_to / status / room_id
+    分頁：limit（最多 500）+ cursor（上一頁回傳的 next_cursor），依 (created_at, id) keyset 分頁，
+         回傳 {'bookings': [...], 'next_cursor': ...}；未帶 limit 時維持舊格式回傳完整陣列
+    欄位：fields=id,booking_number,...（選填，只回傳指定欄位）
+    """
+    err = check_admin()
+    if err: return err
+    from sqlalchemy.orm import joinedload
+    try:
+        clauses = _booking_filter_clauses()
+        limit = request.args.get('limit')
+        limit = max(1, min(int(limit), BOOKINGS_PAGE_MAX)) if limit else None
+    except ValueError:
+        return jsonify({'error': '參數格式錯誤'}), 400
+    q = Booking.query.options(joinedload(Booking.room)).filter(*clauses)
+    # NULL created_at（舊資料）一律排最後，各資料庫一致，cursor 條件才能對應
+    q = q.order_by(Booking.created_at.desc().nulls_last(), Booking.id.desc())
+
+    fields = [f for f in request.args.get('fields', '').split(',') if f]
+    def serialize(b):
+        d = b.to_dict()
+        return {f: d[f] for f in fields if f in d} if fields else d
+
+    if not limit:
+        return jsonify([serialize(b) for b in q.all()])
+
+    if cursor := request.args.get('cursor'):
+        try:
+            c_at, c_id = _decode_booking_cursor(cursor)
+        except Exception:
+            return jsonify({'error': 'cursor 格式錯誤'}), 400
+        if c_at is not None:
+            q = q.filter((Booking.created_at < c_at) |
+                         ((Booking.created_at == c_at) & (Booking.id < c_id)) |
+                         Booking.created_at.is_(None))
+        else:
+            q = q.filter(Booking.created_at.is_(None), Booking.id < c_id)
+    rows = q.limit(limit + 1).all()
+    next_cursor = _encode_booking_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return jsonify({'bookings': [serialize(b) for b in rows[:limit]],
+                    'next_cursor': next_cursor})
+
+EXPORT_COLUMNS = ['id', 'booking_number', 'room_id', 'room_name', 'room_type',
+                  'customer_name', 'customer_phone', 'customer_email', 'department',
+                  'date', 'start_time', 'end_time', 'segments', 'duration', 'total_price',
+                  'attendees', 'purpose', 'status', 'note', 'created_at']
+EXPORT_BATCH = 1000
+
+
+@app.route('/admin/api/bookings/export', methods=['GET'])
+def admin_export_bookings():
+    """串流匯出預約（format=csv 預設 / ndjson），篩選條件同 /admin/api/bookings
+
+    以 yield_per 分批讀取（PostgreSQL 為 server-side cursor），逐批寫出，
+    不論筆數多寡記憶體用量固定。
+    """
+    err = check_admin()
+    if err: return err
+    import csv, io
+    from flask import stream_with_context
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format 需為 csv 或 ndjson'}), 400
+    try:
+        clauses = _booking_filter_clauses()
+    except ValueError:
+        return jsonify({'error': 'room_id 格式錯誤'}), 400
+
+    cols = [getattr(Booking, c) for c in EXPORT_COLUMNS
+            if c not in ('room_name', 'room_type')]
+    stmt = db.select(*cols, Room.name.label('room_name'), Room.room_type.label('room_type')
+                     ).outerjoin(Room, Room.id == Booking.room_id).where(*clauses
+                     ).order_by(Booking.date, Booking.start_time, Booking.id
+                     ).execution_options(yield_per=EXPORT_BATCH)
+
+    def _row(r):
+        d = r._asdict()
+        d['created_at'] = d['created_at'].strftime('%Y-%m-%d %H:%M') if d['created_at'] else ''
+        return d
+
+    def generate():
+        result = db.session.execute(stmt)
+        if fmt == 'csv':
+            buf = io.StringIO()
+            writer = csv.DictWriter(buf, fieldnames=EXPORT_COLUMNS, extrasaction='ignore')
+            buf.write('\ufeff')   # BOM：Excel 開啟中文不亂碼
+            writer.writeheader()
+            for rows in result.partitions():
+                writer.writerows(_row(r) for r in rows)
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+            yield buf.getvalue()
+        else:
+            for rows in result.partitions():
+                yield ''.join(json.dumps(_row(r), ensure_ascii=False) + '\n' for r in rows)
+
+    name = f"bookings_{tw_now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    resp = app.response_class(stream_with_context(generate()), mimetype=mimetype)
+    resp.headers['Content-Disposition'] = f'attachment; filename="{name}"'
+    return resp
+
+
+BULK_IMPORT_MAX = 2000
+
+
+def _read_import_rows():
+    """JSON 陣列（或 {'bookings': [...]}）或 multipart 上傳的 CSV（file 欄位，首列為欄名）"""
+    if 'file' in request.files:
+        import csv, io
+        text = request.files['file'].read().decode('utf-8-sig')
+        return list(csv.DictReader(io.StringIO(text)))
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('bookings')
+    if not isinstance(data, list):
+        raise ValueError('請上傳 CSV 檔或 JSON 陣列')
+    return data
+
+
+def _validate_import_row(row, rooms_by_id, rooms_by_name):
+    """欄位檢查（不含時段衝突），回傳 (正規化後的 dict, None) 或 (None, 錯誤訊息)"""
+    room = None
+    if str(row.get('room_id') or '').strip():
+        try:
+            room = rooms_by_id.get(int(row['room_id']))
+        except (TypeError, ValueError):   # JSON 可能傳入陣列 / 物件
+            pass
+    elif row.get('room_name'):
+        room = rooms_by_name.get(str(row['room_name']).strip())
+    if not room:
+        return None, '找不到此會議室'
+    try:
+        date = datetime.strptime(str(row.get('date', '')).strip(), '%Y-%m-%d').strftime('%Y-%m-%d')
+        start, end = _to_min(str(row['start_time'])), _to_min(str(row['end_time']))
+    except (KeyError, TypeError, ValueError):
+        return None, '日期或時間格式錯誤'
+    if not 0 <= start < end <= 24 * 60:
+        return None, '結束時間需晚於開始時間'
+    name, phone = str(row.get('name') or '').strip(), str(row.get('phone') or '').strip()
+    if not name or not phone:
+        return None, '請填寫聯絡人姓名與手機號碼'
+    try:
+        attendees = int(row.get('attendees') or 1)
+    except (TypeError, ValueError):
+        return None, '人數格式錯誤'
+    dur = (end - start) / 60
+    return {
+        'room_id': room.id, 'customer_name': name, 'customer_phone': phone,
+        'customer_email': str(row.get('email') or '').strip(),
+        'department': str(row.get('department') or ''),
+        'date': date, 'start_time': _fmt_min(start), 'end_time': _fmt_min(end),
+        'duration': dur, 'total_price': int(dur * room.hourly_rate),
+        'attendees': attendees, 'purpose': str(row.get('purpose') or ''),
+        'note': str(row.get('note') or ''), 'status': 'confirmed', 'created_at': tw_now(),
+        '_span': (start, end),
+    }, None
+
+
+@app.route('/admin/api/bookings/import', methods=['POST'])
+def admin_import_bookings():
+    """批次匯入預約（活動日大量配位）
+
+    內容：JSON 陣列或 CSV（file 欄位），欄位 room_id 或 room_name、date、start_time、end_time、
+         name、phone，選填 email、department、attendees、purpose、note。
+    mode=atomic（預設，任一列錯誤整批不寫入）或 best_effort（寫入可用的列，回報錯誤列）。
+    受影響的 (會議室, 日期) 一次鎖定、一次載入占用，批次內彼此的衝突也會檢出；
+    編號一次配發，預約與時段列以 executemany 寫入。匯入不發送通知。
+    """
     err = check_admin()
     if err: return err
-    q = Booking.query
-    if v := request.args.get('date'):    q = q.filter_by(date=v)
-    if v := request.args.get('status'):  q = q.filter_by(status=v)
-    if v := request.args.get('room_id'): q = q.filter_by(room_id=int(v))
-    return jsonify([b.to_dict() for b in q.order_by(Booking.created_at.desc()).all()])
+    mode = request.args.get('mode', 'atomic')
+    if mode not in ('atomic', 'best_effort'):
+        return jsonify({'error': 'mode 需為 atomic 或 best_effort'}), 400
+    try:
+        raw = _read_import_rows()
+    except UnicodeDecodeError:   # ValueError 的子類別，需先攔截
+        return jsonify({'error': 'CSV 需為 UTF-8 編碼'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not raw:
+        return jsonify({'error': '沒有資料'}), 400
+    if len(raw) > BULK_IMPORT_MAX:
+        return jsonify({'error': f'單次最多匯入 {BULK_IMPORT_MAX} 筆'}), 400
+
+    rooms = Room.query.filter_by(is_active=True).all()
+    rooms_by_id = {r.id: r for r in rooms}
+    rooms_by_name = {r.name: r for r in rooms}
+    rows, errors = [], []
+    for i, row in enumerate(raw, start=1):
+        if not isinstance(row, dict):
+            errors.append({'row': i, 'error': '資料格式錯誤'})
+            continue
+        m, msg = _validate_import_row(row, rooms_by_id, rooms_by_name)
+        if msg:
+            errors.append({'row': i, 'error': msg})
+        else:
+            rows.append((i, m))
+    if (errors and mode == 'atomic') or not rows:
+        return jsonify({'success': False, 'created': 0, 'errors': errors}), 400
+
+    # 編號在鎖定前一次配發（配發使用獨立連線）；未寫入的列只會造成跳號
+    numbers = generate_booking_numbers(len(rows))
+    keys = sorted({(m['room_id'], m['date']) for _, m in rows})
+    try:
+        for room_id, date in keys:
+            acquire_slot_lock(room_id, date)
+        # 占用索引：每個 (會議室, 日期) 一個 1440 位元的分鐘遮罩，接受一列就併入一列
+        occupied = {k: 0 for k in keys}
+        dates = sorted({d for _, d in keys})
+        room_ids = sorted({r for r, _ in keys})
+        for rid, d, s, e in db.session.query(
+                BookingSegment.room_id, BookingSegment.date,
+                BookingSegment.start_min, BookingSegment.end_min
+        ).join(Booking, BookingSegment.booking_id == Booking.id).filter(
+                BookingSegment.room_id.in_(room_ids), BookingSegment.date.in_(dates),
+                Booking.status.in_(ACTIVE_STATUSES)).all():
+            if (rid, d) in occupied:
+                occupied[(rid, d)] |= _minute_mask(s, e)
+        for bl in blocked_intervals(dates[0], dates[-1], room_ids):
+            m = _minute_mask(_to_min(bl.start_time), _to_min(bl.end_time))
+            for rid in ([bl.room_id] if bl.room_id is not None else room_ids):
+                if (rid, bl.date) in occupied:
+                    occupied[(rid, bl.date)] |= m
+
+        accepted = []
+        for i, m in rows:
+            key, span = (m['room_id'], m['date']), _minute_mask(*m['_span'])
+            if occupied[key] & span:
+                errors.append({'row': i, 'error': f"{m['date']} {m['start_time']}–{m['end_time']} 時段已被預約"})
+                continue
+            occupied[key] |= span
+            accepted.append(m)
+        if errors and mode == 'atomic':
+            db.session.rollback()
+            return jsonify({'success': False, 'created': 0,
+                            'errors': sorted(errors, key=lambda e: e['row'])}), 409
+        if not accepted:
+            # best_effort 且每列都衝突：不執行空的 INSERT
+            db.session.rollback()
+            return jsonify({'success': True, 'created': 0, 'booking_numbers': [],
+                            'errors': sorted(errors, key=lambda e: e['row'])}), 200
+
+        mappings = [{**m, 'booking_number': number} for m, number in zip(accepted, numbers)]
+        ids = db.session.scalars(
+            db.insert(Booking).returning(Booking.id, sort_by_parameter_order=True),
+            [{k: v for k, v in m.items() if k != '_span'} for m in mappings]).all()
+        db.session.execute(db.insert(BookingSegment), [
+            {'booking_id': bid, 'room_id': m['room_id'], 'date': m['date'],
+             'start_min': m['_span'][0], 'end_min': m['_span'][1]}
+            for bid, m in zip(ids, mappings)])
+        # executemany 不經過 ORM flush，彙總表差額在此一併寫入
+        deltas = {}
+        for m in mappings:
+            _add_stat_delta(deltas, _stat_entry(m['room_id'], m['date'], m['status'],
+                                                m['total_price'], None,
+                                                m['start_time'], m['end_time']), 1)
+        apply_stat_deltas(db.session, deltas)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f'[import_bookings error] {type(e).__name__}: {e}')
+        return jsonify({'error': f'匯入失敗（{type(e).__name__}）'}), 500
+    return jsonify({'success': True, 'created': len(mappings),
+                    'booking_numbers': [m['booking_number'] for m in mappings],
+                    'errors': sorted(errors, key=lambda e: e['row'])}), 201
+
 
 @app.route('/admin/api/bookings/<int:bid>/cancel', methods=['POST'])
 def admin_cancel_booking(bid):
@@ -2837,18 +4742,10 @@ def admin_cancel_booking(bid):
     if err: return err
     b = Booking.query.get_or_404(bid)
     b.status = 'cancelled'
+    # LINE / Email / SMS 取消通知寫入 outbox，與狀態變更同一交易
+    queue_booking_cancel_notifications(b)
     db.session.commit()
-    if b.line_user_id:
-        push_line(b.line_user_id, [flex_booking_cancel(b)])
-    # Email 取消通知
-    if b.customer_email:
-        send_email(
-            b.customer_email,
-            f'【預約取消】{b.room.name if b.room else ""} – {b.date}',
-            _cancel_email_html(b)
-        )
-    # SMS 取消通知
-    send_sms(b.customer_phone, _cancel_sms_body(b))
+    wake_outbox_dispatcher()
     return jsonify({'success': True})
 
 @app.route('/admin/api/bookings/<int:bid>/complete', methods=['POST'])
@@ -2879,11 +4776,73 @@ def admin_toggle_line_admin(uid):
     lu = LineUser.query.filter_by(line_user_id=uid).first_or_404()
     lu.is_admin = not lu.is_admin
     db.session.commit()
+    invalidate_admin_line_ids()
     return jsonify(lu.to_dict())
 
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', '4'))
+BROADCAST_STALE_SECONDS = 300   # queued / running 超過此秒數沒有進度，視為行程已中斷
+
+
+def fail_stale_broadcast_jobs() -> int:
+    """發送中行程中斷（重新部署、worker 被終止）而停在 queued / running 的廣播工作標記為失敗，
+    回傳筆數。以心跳 updated_at 判斷，仍在其他 worker 正常發送的工作不受影響。"""
+    cutoff = tw_now() - timedelta(seconds=BROADCAST_STALE_SECONDS)
+    n = BroadcastJob.query.filter(
+        BroadcastJob.status.in_(('queued', 'running')),
+        func.coalesce(BroadcastJob.updated_at, BroadcastJob.created_at) < cutoff
+    ).update({'status': 'failed', 'finished_at': tw_now()}, synchronize_session=False)
+    db.session.commit()
+    return n
+
+
+def _run_broadcast_job(job_id: int, user_ids: list, messages: list):
+    """背景執行廣播：切成 LINE_MULTICAST_MAX 一批，並行送出，每批完成即更新進度"""
+    chunks = [user_ids[i:i + LINE_MULTICAST_MAX]
+              for i in range(0, len(user_ids), LINE_MULTICAST_MAX)]
+    with app.app_context():
+        try:
+            job = BroadcastJob.query.get(job_id)
+            job.status = 'running'
+            db.session.commit()
+            results = []
+            with ThreadPoolExecutor(max_workers=BROADCAST_CONCURRENCY,
+                                    thread_name_prefix='broadcast') as pool:
+                futures = {pool.submit(multicast_line, chunk, messages): (i, len(chunk))
+                           for i, chunk in enumerate(chunks)}
+                for fut in as_completed(futures):
+                    idx, size = futures[fut]
+                    try:
+                        ok, error = fut.result()
+                    except Exception as e:
+                        ok, error = False, str(e)[:200]
+                    results.append({'index': idx, 'size': size, 'ok': ok, 'error': error})
+                    if ok:
+                        job.sent += size
+                    else:
+                        job.failed += size
+                    job.chunks = json.dumps(sorted(results, key=lambda r: r['index']),
+                                            ensure_ascii=False)
+                    db.session.commit()
+            job.status = 'failed' if job.failed and not job.sent else 'done'
+            job.finished_at = tw_now()
+            db.session.commit()
+            print(f'[broadcast] job #{job_id} 完成：{job.sent} 成功 / {job.failed} 失敗')
+        except Exception as e:
+            db.session.rollback()
+            BroadcastJob.query.filter_by(id=job_id).update(
+                {'status': 'failed', 'finished_at': tw_now()})
+            db.session.commit()
+            print(f'[broadcast] job #{job_id} error: {type(e).__name__}: {e}')
+        finally:
+            db.session.remove()
+
+
 @app.route('/admin/api/line-broadcast', methods=['POST'])
 def admin_broadcast():
-    """廣播文字訊息給所有（或僅管理員）LINE 使用者"""
+    """廣播文字訊息給所有（或僅管理員）LINE 使用者
+
+    以 multicast 分批背景發送，立即回傳 job_id；進度查詢 GET /admin/api/line-broadcast/<job_id>
+    """
     err = check_admin()
     if err: return err
     d       = request.get_json()
@@ -2891,13 +4850,28 @@ def admin_broadcast():
     admonly = d.get('admins_only', False)
     if not msg:
         return jsonify({'error': '訊息不能為空'}), 400
-    q = LineUser.query
+    q = db.session.query(LineUser.line_user_id)
     if admonly:
-        q = q.filter_by(is_admin=True)
-    users = q.all()
-    for u in users:
-        push_line(u.line_user_id, [{'type': 'text', 'text': msg}])
-    return jsonify({'success': True, 'sent': len(users)})
+        q = q.filter(LineUser.is_admin == True)
+    user_ids = [uid for (uid,) in q.all()]
+    creator = get_current_admin()
+    job = BroadcastJob(message=msg, admins_only=bool(admonly), total=len(user_ids),
+                       created_by=creator.username if creator else 'admin')
+    db.session.add(job)
+    db.session.commit()
+    threading.Thread(target=_run_broadcast_job, name=f'broadcast-{job.id}', daemon=True,
+                     args=(job.id, user_ids, [{'type': 'text', 'text': msg}])).start()
+    return jsonify({'success': True, 'job_id': job.id, 'total': len(user_ids)}), 202
+
+
+@app.route('/admin/api/line-broadcast/<int:job_id>', methods=['GET'])
+def admin_broadcast_status(job_id):
+    err = check_admin()
+    if err: return err
+    job = BroadcastJob.query.get_or_404(job_id)
+    if job.status in ('queued', 'running') and fail_stale_broadcast_jobs():
+        db.session.refresh(job)
+    return jsonify(job.to_dict())
 
 
 # ─────────────────────────────────────────────
@@ -2908,17 +4882,20 @@ def admin_broadcast():
 def admin_get_site_content():
     err = check_admin()
     if err: return err
-    data = {i.key: i.value for i in SiteContent.query.all()}
+    data = dict(SiteContent.all_values())
     if 'form_fields' not in data or not data['form_fields']:
-        data['form_fields'] = '[{"id": "name", "label": "聯絡人姓名", "type": "text", "placeholder": "請輸入姓名", "required": true, "system": true, "full": false}, {"id": "phone", "label": "手機號碼", "type": "tel", "placeholder": "0912345678", "required": true, "system": true, "full": false}, {"id": "email", "label": "Email", "type": "email", "placeholder": "your@email.com", "required": true, "system": true, "full": false, "hint": "必填，接收確認信"}, {"id": "department", "label": "部門／公司", "type": "text", "placeholder": "例：行銷部", "required": false, "system": true, "full": false}, {"id": "attendees", "label": "預計出席人數", "type": "select", "options": "1,2,3,4,5,6,8,10,15,20,30,50", "required": false, "system": true, "full": false}, {"id": "purpose", "label": "會議類型", "type": "select", "options": "部門會議,客戶洽談,員工培訓,產品發表,視訊會議,腦力激盪,其他", "required": false, "system": true, "full": false}, {"id": "note", "label": "備註", "type": "textarea", "placeholder": "特殊需求或注意事項...", "required": false, "system": true, "full": true}]'
+        data['form_fields'] = DEFAULT_FORM_FIELDS
     return jsonify(data)
 
 @app.route('/admin/api/site-content', methods=['POST'])
 def admin_update_site_content():
     err = check_admin()
     if err: return err
-    for k, v in request.get_json().items():
-        SiteContent.set(k, v)
+    try:
+        SiteContent.set_many(request.get_json() or {})
+    except Exception as e:
+        print(f'[site content error] {type(e).__name__}: {e}')
+        return jsonify({'error': f'儲存失敗，內容未變更（{type(e).__name__}）'}), 500
     return jsonify({'success': True})
 
 
@@ -2931,18 +4908,280 @@ def admin_get_stats():
     err = check_admin()
     if err: return err
     today = datetime.now().strftime('%Y-%m-%d')
+    # 依狀態一次彙總：筆數、金額、今日筆數
+    rows = db.session.query(
+        Booking.status, func.count(Booking.id),
+        func.coalesce(func.sum(Booking.total_price), 0),
+        func.coalesce(func.sum(case((Booking.date == today, 1), else_=0)), 0)
+    ).group_by(Booking.status).all()
+    by_status = {s: (n, revenue, n_today) for s, n, revenue, n_today in rows}
+    confirmed = by_status.get('confirmed', (0, 0, 0))
     return jsonify({
-        'total_bookings': Booking.query.filter_by(status='confirmed').count(),
-        'today_bookings': Booking.query.filter_by(date=today, status='confirmed').count(),
+        'total_bookings': confirmed[0],
+        'today_bookings': confirmed[2],
         'total_rooms':    Room.query.filter_by(is_active=True).count(),
-        'total_revenue':  db.session.query(func.sum(Booking.total_price))
-                            .filter_by(status='confirmed').scalar() or 0,
-        'cancelled':   Booking.query.filter_by(status='cancelled').count(),
-        'completed':   Booking.query.filter_by(status='completed').count(),
+        'total_revenue':  int(confirmed[1]),
+        'cancelled':   by_status.get('cancelled', (0, 0, 0))[0],
+        'completed':   by_status.get('completed', (0, 0, 0))[0],
         'line_users':  LineUser.query.count(),
     })
 
 
+def _stats_range():
+    """解析 from / to（YYYY-MM-DD），回傳 (d0, d1) 或 (None, 錯誤回應)"""
+    date_from, date_to = request.args.get('from'), request.args.get('to')
+    if not date_from or not date_to:
+        return None, (jsonify({'error': '請提供 from 與 to'}), 400)
+    try:
+        d0 = datetime.strptime(date_from, '%Y-%m-%d')
+        d1 = datetime.strptime(date_to, '%Y-%m-%d')
+    except ValueError:
+        return None, (jsonify({'error': '日期格式錯誤，請使用 YYYY-MM-DD'}), 400)
+    if d1 < d0:
+        return None, (jsonify({'error': 'to 不可早於 from'}), 400)
+    return (d0, d1), None
+
+
+def _stats_query(d0, d1, *group_by):
+    q = db.session.query(
+        *group_by, BookingDailyStat.status,
+        func.sum(BookingDailyStat.booking_count),
+        func.sum(BookingDailyStat.revenue),
+        func.sum(BookingDailyStat.booked_minutes)
+    ).filter(BookingDailyStat.date >= d0.strftime('%Y-%m-%d'),
+             BookingDailyStat.date <= d1.strftime('%Y-%m-%d'))
+    if rid := request.args.get('room_id', type=int):
+        q = q.filter(BookingDailyStat.room_id == rid)
+    return q.group_by(*group_by, BookingDailyStat.status)
+
+
+def _stats_bucket():
+    return {'bookings': 0, 'revenue': 0, 'booked_minutes': 0, 'cancelled': 0}
+
+
+def _stats_add(bucket, status, n, revenue, minutes):
+    if status in ACTIVE_STATUSES:
+        bucket['bookings'] += int(n or 0)
+        bucket['revenue'] += int(revenue or 0)
+        bucket['booked_minutes'] += int(minutes or 0)
+    elif status == 'cancelled':
+        bucket['cancelled'] += int(n or 0)
+
+
+def _period_key(date_str, granularity):
+    if granularity == 'month':
+        return date_str[:7]
+    if granularity == 'week':
+        d = datetime.strptime(date_str, '%Y-%m-%d')
+        return (d - timedelta(days=d.weekday())).strftime('%Y-%m-%d')
+    return date_str
+
+
+@app.route('/admin/api/stats/trend', methods=['GET'])
+def admin_stats_trend():
+    """營收與使用率趨勢（讀取 booking_daily_stats）
+
+    參數：from=&to=（YYYY-MM-DD）、granularity=day|week|month（預設 day）、room_id（選填）
+    使用率 = 已預約分鐘 ÷（會議室數 × 天數 × 營業時段分鐘數）
+    """
+    err = check_admin()
+    if err: return err
+    rng, err = _stats_range()
+    if err: return err
+    d0, d1 = rng
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ('day', 'week', 'month'):
+        return jsonify({'error': 'granularity 需為 day / week / month'}), 400
+    n_rooms = 1 if request.args.get('room_id') else Room.query.filter_by(is_active=True).count()
+    day_minutes = SLOT_DAY_END - SLOT_DAY_START
+
+    series = {}
+    for i in range((d1 - d0).days + 1):
+        key = _period_key((d0 + timedelta(days=i)).strftime('%Y-%m-%d'), granularity)
+        bucket = series.setdefault(key, {'period': key, 'days': 0, **_stats_bucket()})
+        bucket['days'] += 1
+    for date, status, n, revenue, minutes in _stats_query(d0, d1, BookingDailyStat.date).all():
+        _stats_add(series[_period_key(date, granularity)], status, n, revenue, minutes)
+    for bucket in series.values():
+        capacity = n_rooms * bucket['days'] * day_minutes
+        bucket['utilization'] = round(bucket['booked_minutes'] / capacity, 4) if capacity else 0
+    return jsonify({'from': d0.strftime('%Y-%m-%d'), 'to': d1.strftime('%Y-%m-%d'),
+                    'granularity': granularity, 'series': list(series.values())})
+
+
+@app.route('/admin/api/stats/rooms', methods=['GET'])
+def admin_stats_rooms():
+    """區間內各會議室的營收與使用率（讀取 booking_daily_stats）；參數同 /admin/api/stats/trend"""
+    err = check_admin()
+    if err: return err
+    rng, err = _stats_range()
+    if err: return err
+    d0, d1 = rng
+    capacity = ((d1 - d0).days + 1) * (SLOT_DAY_END - SLOT_DAY_START)
+    names = dict(db.session.query(Room.id, Room.name).all())
+    rooms = {}
+    for rid, status, n, revenue, minutes in _stats_query(d0, d1, BookingDailyStat.room_id).all():
+        bucket = rooms.setdefault(rid, {'room_id': rid, 'room_name': names.get(rid, ''),
+                                        **_stats_bucket()})
+        _stats_add(bucket, status, n, revenue, minutes)
+    for bucket in rooms.values():
+        bucket['utilization'] = round(bucket['booked_minutes'] / capacity, 4) if capacity else 0
+    return jsonify({'from': d0.strftime('%Y-%m-%d'), 'to': d1.strftime('%Y-%m-%d'),
+                    'rooms': sorted(rooms.values(), key=lambda r: -r['revenue'])})
+
+
+# ─────────────────────────────────────────────
+# Analytics — 使用率
+# ─────────────────────────────────────────────
+# 每間會議室每日以 1440 位元的整數表示（第 m 位 = 當日第 m 分鐘），
+# 區間聯集 / 扣除封鎖時段 / 依小時切片都是整數位元運算 + bit_count()，
+# 不必逐分鐘、逐筆在 Python 迴圈中累加。
+ANALYTICS_CACHE_TTL  = int(os.environ.get('ANALYTICS_CACHE_TTL', '300'))
+ANALYTICS_MAX_DAYS   = 366
+_ANALYTICS_CACHE_MAX = 64
+_analytics_cache = {}   # (from, to, room_ids, day_start, day_end) → (computed_at, report)
+_HOUR_MASKS = [((1 << 60) - 1) << (h * 60) for h in range(24)]
+WEEKDAY_LABELS = ['週一', '週二', '週三', '週四', '週五', '週六', '週日']
+
+
+def _minute_mask(start: int, end: int) -> int:
+    """[start, end) 分鐘區間 → 當日分鐘位元遮罩"""
+    start, end = max(0, start), min(24 * 60, end)
+    return ((1 << (end - start)) - 1) << start if end > start else 0
+
+
+def _rate(booked, available):
+    return round(booked / available, 4) if available else None
+
+
+def utilization_report(date_from, date_to, room_ids, day_start=SLOT_DAY_START, day_end=SLOT_DAY_END):
+    """區間內的使用率：每間會議室、每小時、每星期幾，以及星期 × 小時熱度圖
+
+    可用時間 = 營業時段（day_start–day_end）扣除封鎖時段；
+    使用率 = 落在可用時間內的已預約分鐘 ÷ 可用分鐘。
+    """
+    room_ids = sorted(set(room_ids))   # 重複的 id 會讓可用分鐘重複計算
+    d0 = datetime.strptime(date_from, '%Y-%m-%d')
+    n_days = (datetime.strptime(date_to, '%Y-%m-%d') - d0).days + 1
+    open_mask = _minute_mask(day_start, day_end)
+    open_hours = [open_mask & hm for hm in _HOUR_MASKS]
+    open_hour_min = [m.bit_count() for m in open_hours]
+
+    booked = {}    # (room_id, date) → 已預約分鐘遮罩
+    blocked = {}   # (room_id, date) → 封鎖分鐘遮罩
+    if room_ids:
+        rows = db.session.query(
+            BookingSegment.room_id, BookingSegment.date,
+            BookingSegment.start_min, BookingSegment.end_min
+        ).join(Booking, BookingSegment.booking_id == Booking.id).filter(
+            BookingSegment.room_id.in_(room_ids),
+            BookingSegment.date >= date_from, BookingSegment.date <= date_to,
+            BookingSegment.start_min < day_end, BookingSegment.end_min > day_start,
+            Booking.status.in_(ACTIVE_STATUSES)).all()
+        for rid, d, s, e in rows:
+            booked[(rid, d)] = booked.get((rid, d), 0) | _minute_mask(s, e)
+        for bl in blocked_intervals(date_from, date_to, room_ids):
+            m = _minute_mask(_to_min(bl.start_time), _to_min(bl.end_time)) & open_mask
+            for rid in ([bl.room_id] if bl.room_id is not None else room_ids):
+                blocked[(rid, bl.date)] = blocked.get((rid, bl.date), 0) | m
+
+    # 先假設每個 (會議室, 日期) 全天可用，再只對有預約或封鎖的格子修正
+    weekday_days = [0] * 7
+    for i in range(n_days):
+        weekday_days[(d0 + timedelta(days=i)).weekday()] += 1
+    heat_booked = [[0] * 24 for _ in range(7)]
+    heat_avail  = [[weekday_days[w] * len(room_ids) * open_hour_min[h] for h in range(24)]
+                   for w in range(7)]
+    room_booked = {rid: 0 for rid in room_ids}
+    room_avail  = {rid: n_days * open_mask.bit_count() for rid in room_ids}
+
+    for key in booked.keys() | blocked.keys():
+        rid, d = key
+        w = datetime.strptime(d, '%Y-%m-%d').weekday()
+        block = blocked.get(key, 0)
+        occ = booked.get(key, 0) & open_mask & ~block
+        room_booked[rid] += occ.bit_count()
+        room_avail[rid] -= block.bit_count()
+        for h in range(24):
+            if not open_hour_min[h]:
+                continue
+            if occ:
+                heat_booked[w][h] += (occ & _HOUR_MASKS[h]).bit_count()
+            if block:
+                heat_avail[w][h] -= (block & _HOUR_MASKS[h]).bit_count()
+
+    hours = [h for h in range(24) if open_hour_min[h]]
+    by_hour = []
+    for h in hours:
+        b = sum(heat_booked[w][h] for w in range(7))
+        a = sum(heat_avail[w][h] for w in range(7))
+        by_hour.append({'hour': h, 'booked_minutes': b, 'available_minutes': a,
+                        'utilization': _rate(b, a)})
+    by_weekday = []
+    for w in range(7):
+        b, a = sum(heat_booked[w]), sum(heat_avail[w])
+        by_weekday.append({'weekday': w, 'label': WEEKDAY_LABELS[w], 'booked_minutes': b,
+                           'available_minutes': a, 'utilization': _rate(b, a)})
+    names = dict(db.session.query(Room.id, Room.name).filter(Room.id.in_(room_ids)).all()) if room_ids else {}
+    rooms = [{'room_id': rid, 'room_name': names.get(rid, ''),
+              'booked_minutes': room_booked[rid], 'available_minutes': room_avail[rid],
+              'utilization': _rate(room_booked[rid], room_avail[rid])} for rid in room_ids]
+    total_b, total_a = sum(room_booked.values()), sum(room_avail.values())
+    return {
+        'from': date_from, 'to': date_to,
+        'day_start': _fmt_min(day_start), 'day_end': _fmt_min(day_end),
+        'overall': {'booked_minutes': total_b, 'available_minutes': total_a,
+                    'utilization': _rate(total_b, total_a)},
+        'rooms': rooms, 'by_hour': by_hour, 'by_weekday': by_weekday,
+        'hours': hours,
+        'heatmap': [[_rate(heat_booked[w][h], heat_avail[w][h]) for h in hours] for w in range(7)],
+    }
+
+
+def cached_utilization_report(date_from, date_to, room_ids, day_start, day_end):
+    """依 (區間, 會議室組合, 營業時段) 快取 ANALYTICS_CACHE_TTL 秒"""
+    import time
+    key = (date_from, date_to, tuple(sorted(set(room_ids))), day_start, day_end)
+    now = time.time()
+    cached = _analytics_cache.get(key)
+    if cached and now - cached[0] < ANALYTICS_CACHE_TTL:
+        return cached[1]
+    report = utilization_report(date_from, date_to, list(key[2]), day_start, day_end)
+    if len(_analytics_cache) >= _ANALYTICS_CACHE_MAX:
+        _analytics_cache.pop(min(_analytics_cache, key=lambda k: _analytics_cache[k][0]), None)
+    _analytics_cache[key] = (now, report)
+    return report
+
+
+@app.route('/admin/api/analytics/utilization', methods=['GET'])
+def admin_analytics_utilization():
+    """會議室使用率分析（每間、每小時、每星期幾、星期 × 小時熱度圖）
+
+    參數：from=&to=（YYYY-MM-DD，最多 366 天）、room_ids=1,2（選填，預設所有啟用中的會議室）、
+         day_start=08:00、day_end=22:00
+    """
+    err = check_admin()
+    if err: return err
+    rng, err = _stats_range()
+    if err: return err
+    d0, d1 = rng
+    if (d1 - d0).days >= ANALYTICS_MAX_DAYS:
+        return jsonify({'error': f'日期區間需在 {ANALYTICS_MAX_DAYS} 天以內'}), 400
+    try:
+        day_start = _to_min(request.args.get('day_start', _fmt_min(SLOT_DAY_START)))
+        day_end   = _to_min(request.args.get('day_end', _fmt_min(SLOT_DAY_END)))
+        if v := request.args.get('room_ids'):
+            room_ids = sorted({int(x) for x in v.split(',') if x.strip()})
+        else:
+            room_ids = [rid for (rid,) in db.session.query(Room.id).filter_by(is_active=True).all()]
+    except ValueError:
+        return jsonify({'error': '參數格式錯誤'}), 400
+    if not 0 <= day_start < day_end <= 24 * 60:
+        return jsonify({'error': '時段設定錯誤'}), 400
+    return jsonify(cached_utilization_report(
+        d0.strftime('%Y-%m-%d'), d1.strftime('%Y-%m-%d'), room_ids, day_start, day_end))
+
+
 # ─────────────────────────────────────────────
 # Seed
 # ─────────────────────────────────────────────
@@ -2987,9 +5226,12 @@ ROOM_SEED = [
 
 
 def seed():
-    for k, v in DEFAULT_CONTENT.items():
-        if not SiteContent.query.filter_by(key=k).first():
-            db.session.add(SiteContent(key=k, value=v))
+    existing = {k for (k,) in db.session.query(SiteContent.key).all()}
+    missing = {k: v for k, v in DEFAULT_CONTENT.items() if k not in existing}
+    for k, v in missing.items():
+        db.session.add(SiteContent(key=k, value=v))
+    if missing:
+        bump_cache_version('site_content')
     if Room.query.count() == 0:
         for r in ROOM_SEED:
             db.session.add(Room(
@@ -3016,70 +5258,208 @@ def seed():
     Room.query.filter(
         ~Room.floor.in_(['2F', '3F'])
     ).update({'floor': '3F'}, synchronize_session=False)
+    bump_cache_version('rooms')
     db.session.commit()
     print('資料庫初始化完成')
 
 
-with app.app_context():
-    db.create_all()
-    # ── 欄位遷移：補上舊資料庫缺少的欄位 ──
+# ─────────────────────────────────────────────
+# Schema Migrations
+# ─────────────────────────────────────────────
+# 依序套用的 migration 步驟，schema_version 記錄已完成到第幾步。
+# 新增欄位 / 資料表 / 回填時在 MIGRATIONS 末端追加新步驟，已發布的步驟不要再改。
+
+AUTO_MIGRATE      = os.environ.get('AUTO_MIGRATE', 'on')   # on / off（off 時請於部署前執行 flask migrate）
+_MIGRATE_LOCK_KEY = 5_201_314   # PostgreSQL advisory lock 鍵值
+
+# 導入 schema_version 前以啟動檢查補上的欄位；舊資料庫可能缺其中任一欄
+_LEGACY_COLUMNS = [
+    ('line_users', 'booking_session', 'TEXT'),
+    ('bookings',   'segments',        'TEXT'),
+    ('bookings',   'series_id',       'INTEGER'),
+    ('rooms',      'photos',          'TEXT'),
+    ('rooms',      'cover_index',     'INTEGER DEFAULT 0'),
+    ('rooms',      'capacity_min',    'INTEGER DEFAULT 0'),
+    ('rooms',      'min_hours',       'FLOAT DEFAULT 1.0'),
+]
+
+
+def _m_create_tables():
+    """建立缺少的資料表（新資料庫一次建好全部欄位與索引）"""
+    with db.engine.begin() as conn:
+        db.metadata.create_all(conn)
+
+
+def _m_legacy_columns():
+    with db.engine.begin() as conn:
+        inspector = db.inspect(conn)
+        for table, column, ddl in _LEGACY_COLUMNS:
+            if column not in {c['name'] for c in inspector.get_columns(table)}:
+                conn.execute(db.text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+                print(f'[migrate] 新增 {table}.{column} 欄位')
+
+
+def _m_indexes():
+    with db.engine.begin() as conn:
+        for name in ensure_indexes(conn):
+            print(f'[migrate] 新增索引 {name}')
+
+
+def _m_backfill_segments():
+    """舊預約尚無正規化時段列者補上 booking_segments"""
+    missing = Booking.query.filter(~Booking.segment_rows.any()).all()
+    for b in missing:
+        b.sync_segments()
+    db.session.commit()
+    if missing:
+        print(f'[migrate] 回填 booking_segments：{len(missing)} 筆預約')
+
+
+def _m_backfill_daily_stats():
+    """彙總表為空但已有預約時全量重建"""
+    if not BookingDailyStat.query.first() and Booking.query.first():
+        print(f'[migrate] 重建 booking_daily_stats：{rebuild_daily_stats()} 列')
+
+
+def _m_superadmin():
+    if not AdminUser.query.filter_by(username='admin').first():
+        su = AdminUser(username='admin', display_name='超級管理員',
+                       role='superadmin', is_active=True, created_by='system')
+        su.set_password(ADMIN_PASSWORD)
+        db.session.add(su)
+        db.session.commit()
+        print(f'[migrate] superadmin created, pw={ADMIN_PASSWORD}')
+
+
+def _m_normalize_blocked_rule_dates():
+    """舊版未補零的規則日期（2026-12-1）改為 YYYY-MM-DD，字串比較才會正確"""
+    fixed = 0
+    for rule in BlockedRule.query.all():
+        d0 = datetime.strptime(rule.date_from, '%Y-%m-%d').strftime('%Y-%m-%d')
+        d1 = datetime.strptime(rule.date_to, '%Y-%m-%d').strftime('%Y-%m-%d')
+        if (d0, d1) != (rule.date_from, rule.date_to):
+            rule.date_from, rule.date_to = d0, d1
+            fixed += 1
+    if fixed:
+        bump_cache_version('blocked_rules')
+        print(f'[migrate] 修正封鎖規則日期格式：{fixed} 筆')
+    db.session.commit()
+
+
+def _m_broadcast_heartbeat():
+    with db.engine.begin() as conn:
+        if 'updated_at' not in {c['name'] for c in db.inspect(conn).get_columns('broadcast_jobs')}:
+            conn.execute(db.text('ALTER TABLE broadcast_jobs ADD COLUMN updated_at TIMESTAMP'))
+            print('[migrate] 新增 broadcast_jobs.updated_at 欄位')
+
+
+MIGRATIONS = [
+    (1, '建立資料表',                 _m_create_tables),
+    (2, '補上舊版資料庫缺少的欄位',    _m_legacy_columns),
+    (3, '補建索引',                   _m_indexes),
+    (4, '回填 booking_segments',      _m_backfill_segments),
+    (5, '回填 booking_daily_stats',   _m_backfill_daily_stats),
+    (6, '建立超級管理員',              _m_superadmin),
+    (7, '初始資料（前台文字 / 會議室）', seed),
+    (8, '封鎖規則日期補零',            _m_normalize_blocked_rule_dates),
+    (9, '廣播工作心跳欄位',            _m_broadcast_heartbeat),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def current_schema_version():
+    """目前資料庫的 schema 版本（schema_version 尚不存在時視為 0）"""
     try:
-        with db.engine.connect() as conn:
-            existing = db.engine.dialect.get_columns(conn, 'line_users')
-            col_names = [c['name'] for c in existing]
-            if 'booking_session' not in col_names:
-                conn.execute(db.text(
-                    'ALTER TABLE line_users ADD COLUMN booking_session TEXT'))
-                conn.commit()
-                print('[migrate] 新增 line_users.booking_session 欄位')
-            # bookings.segments
-            bk_cols = [c['name'] for c in db.engine.dialect.get_columns(conn, 'bookings')]
-            if 'segments' not in bk_cols:
-                conn.execute(db.text('ALTER TABLE bookings ADD COLUMN segments TEXT'))
-                conn.commit()
-                print('[migrate] 新增 bookings.segments 欄位')
-            # rooms.photos / cover_index
-            rm_cols = [c['name'] for c in db.engine.dialect.get_columns(conn, 'rooms')]
-            if 'photos' not in rm_cols:
-                conn.execute(db.text('ALTER TABLE rooms ADD COLUMN photos TEXT'))
-                conn.commit()
-                print('[migrate] 新增 rooms.photos 欄位')
-            if 'cover_index' not in rm_cols:
-                conn.execute(db.text('ALTER TABLE rooms ADD COLUMN cover_index INTEGER DEFAULT 0'))
-                conn.commit()
-                print('[migrate] 新增 rooms.cover_index 欄位')
-            # blocked_slots table
-            inspector = db.inspect(db.engine)
-            existing_tables = inspector.get_table_names()
-            if 'blocked_slots' not in existing_tables:
-                db.create_all()
-                print('[migrate] 新增 blocked_slots table')
-            if 'capacity_min' not in rm_cols:
-                conn.execute(db.text('ALTER TABLE rooms ADD COLUMN capacity_min INTEGER DEFAULT 0'))
-                conn.commit()
-                print('[migrate] 新增 rooms.capacity_min 欄位')
-            if 'min_hours' not in rm_cols:
-                conn.execute(db.text('ALTER TABLE rooms ADD COLUMN min_hours FLOAT DEFAULT 1.0'))
-                conn.commit()
-                print('[migrate] 新增 rooms.min_hours 欄位')
-    except Exception as e:
-        print(f'[migrate] 欄位檢查略過：{e}')
+        row = db.session.get(SchemaVersion, 1)
+        return row.version if row else 0
+    except Exception:
+        db.session.rollback()
+        return 0
+
+
+def _sqlite_migrate_lock():
+    """SQLite 的 migration 鎖：資料庫檔旁的 .migrate.lock 檔以 flock 獨占。
+    不能用 BEGIN IMMEDIATE（各步驟另開連線寫入，會被自己持有的鎖擋住）；
+    記憶體資料庫或無 fcntl 的平台（Windows 本機開發）回傳 None，不加鎖。"""
     try:
-        db.create_all()
-        print('[migrate] db.create_all() done')
-    except Exception as e:
-        print(f'[migrate] create_all error: {e}')
+        import fcntl
+    except ImportError:
+        return None
+    path = db.engine.url.database
+    if not path or path == ':memory:':
+        return None
+    f = open(f'{path}.migrate.lock', 'w')
+    fcntl.flock(f, fcntl.LOCK_EX)
+    return f
+
+
+def run_migrations():
+    """依序套用尚未執行的 MIGRATIONS，每步完成即寫回版本號。
+    PostgreSQL 以 advisory lock、SQLite 以檔案鎖序列化，多個 worker 同時啟動時只有一個會執行 DDL，
+    其餘等鎖釋放後重讀版本號即直接返回。回傳套用後的版本號。"""
+    lock_conn = lock_file = None
+    if db.engine.dialect.name == 'postgresql':
+        lock_conn = db.engine.connect()
+        lock_conn.execute(db.text('SELECT pg_advisory_lock(:k)'), {'k': _MIGRATE_LOCK_KEY})
+        lock_conn.commit()
+    elif db.engine.dialect.name == 'sqlite':
+        lock_file = _sqlite_migrate_lock()
     try:
-        if not AdminUser.query.filter_by(username='admin').first():
-            su = AdminUser(username='admin', display_name='超級管理員',
-                           role='superadmin', is_active=True, created_by='system')
-            su.set_password(ADMIN_PASSWORD)
-            db.session.add(su)
+        with db.engine.begin() as conn:
+            SchemaVersion.__table__.create(conn, checkfirst=True)
+        current = current_schema_version()
+        for version, desc, step in MIGRATIONS:
+            if version <= current:
+                continue
+            print(f'[migrate] v{version} {desc}')
+            step()
+            row = db.session.get(SchemaVersion, 1) or SchemaVersion(id=1)
+            row.version = version
+            db.session.add(row)
             db.session.commit()
-            print(f'[migrate] superadmin created, pw={ADMIN_PASSWORD}')
+            current = version
+        return current
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        if lock_conn is not None:
+            lock_conn.execute(db.text('SELECT pg_advisory_unlock(:k)'), {'k': _MIGRATE_LOCK_KEY})
+            lock_conn.commit()
+            lock_conn.close()
+        if lock_file is not None:
+            lock_file.close()   # 關檔即釋放 flock
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """套用尚未執行的 schema migration（部署前執行，搭配 AUTO_MIGRATE=off）"""
+    before = current_schema_version()
+    print(f'[migrate] schema v{before} → v{run_migrations()}')
+
+
+# worker 啟動只查一次版本號；落後時才在鎖保護下套用 migration。
+# migration 失敗直接中止啟動，不以半套 schema 對外服務。
+with app.app_context():
+    _schema_version = current_schema_version()
+    if _schema_version < SCHEMA_VERSION:
+        if AUTO_MIGRATE == 'on':
+            try:
+                run_migrations()
+            except Exception as e:
+                print(f'[migrate] 失敗，停止啟動：{type(e).__name__}: {e}')
+                raise
+        else:
+            print(f'[migrate] schema v{_schema_version} 落後程式 v{SCHEMA_VERSION}，'
+                  f'請執行 flask --app app migrate')
+    # 上次行程中斷時停在 running 的廣播工作，不會再有進度，標記為失敗
+    try:
+        if n := fail_stale_broadcast_jobs():
+            print(f'[broadcast] {n} 筆中斷的廣播工作標記為失敗')
     except Exception as e:
-        print(f'[migrate] superadmin error: {e}')
-    seed()
+        db.session.rollback()
+        print(f'[broadcast] 中斷工作檢查略過：{e}')
+
 
 # ─────────────────────────────────────────────
 # Admin -- Accounts & Login Logs
@@ -3199,17 +5579,14 @@ def admin_add_blocked_slot():
     slots_data = d.get('slots', [])
     if not slots_data:
         slots_data = [d]
-    created = []
-    for s in slots_data:
-        bs = BlockedSlot(
-            room_id    = s.get('room_id') or None,
-            date       = s['date'],
-            start_time = s['start_time'],
-            end_time   = s['end_time'],
-            reason     = s.get('reason', ''),
-        )
-        db.session.add(bs)
-        created.append(bs)
+    created = [BlockedSlot(
+        room_id    = s.get('room_id') or None,
+        date       = s['date'],
+        start_time = s['start_time'],
+        end_time   = s['end_time'],
+        reason     = s.get('reason', ''),
+    ) for s in slots_data]
+    db.session.add_all(created)
     db.session.commit()
     return jsonify({'success': True, 'count': len(created)}), 201
 
@@ -3232,6 +5609,60 @@ def admin_bulk_delete_blocked_slots():
     return jsonify({'success': True})
 
 
+@app.route('/admin/api/blocked-rules', methods=['GET'])
+def admin_get_blocked_rules():
+    err = check_admin()
+    if err: return err
+    rules = BlockedRule.query.order_by(BlockedRule.date_from, BlockedRule.start_time).all()
+    names = dict(db.session.query(Room.id, Room.name).all())
+    result = []
+    for r in rules:
+        d = r.to_dict()
+        d['room_names'] = [names.get(rid, '') for rid in d['room_ids']] if d['room_ids'] else ['全館']
+        result.append(d)
+    return jsonify(result)
+
+@app.route('/admin/api/blocked-rules', methods=['POST'])
+def admin_add_blocked_rule():
+    """新增封鎖規則：{date_from, date_to, weekdays: [0..6]（0=週一，空 = 每天）,
+    start_time, end_time, room_ids: [...]（null = 全館）, reason}"""
+    err = check_admin()
+    if err: return err
+    d = request.get_json() or {}
+    try:
+        d0 = datetime.strptime(d['date_from'], '%Y-%m-%d')
+        d1 = datetime.strptime(d['date_to'], '%Y-%m-%d')
+        start, end = _to_min(d['start_time']), _to_min(d['end_time'])
+        weekdays = sorted({int(w) for w in d.get('weekdays') or []})
+        room_ids = [int(r) for r in d['room_ids']] if d.get('room_ids') else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': '欄位格式錯誤'}), 400
+    if d1 < d0 or end <= start or any(not 0 <= w <= 6 for w in weekdays):
+        return jsonify({'error': '日期、時段或星期設定錯誤'}), 400
+    rule = BlockedRule(
+        room_ids   = json.dumps(room_ids) if room_ids else None,
+        # 以零補齊格式儲存：blocked_intervals 以字串比較日期區間
+        date_from  = d0.strftime('%Y-%m-%d'), date_to = d1.strftime('%Y-%m-%d'),
+        weekdays   = ','.join(map(str, weekdays)),
+        start_time = _fmt_min(start), end_time = _fmt_min(end),
+        reason     = d.get('reason', ''),
+    )
+    db.session.add(rule)
+    bump_cache_version('blocked_rules')
+    db.session.commit()
+    return jsonify({'success': True, 'rule': rule.to_dict()}), 201
+
+@app.route('/admin/api/blocked-rules/<int:rid>', methods=['DELETE'])
+def admin_delete_blocked_rule(rid):
+    err = check_admin()
+    if err: return err
+    rule = BlockedRule.query.get_or_404(rid)
+    db.session.delete(rule)
+    bump_cache_version('blocked_rules')
+    db.session.commit()
+    return jsonify({'success': True})
+
+
 # ─────────────────────────────────────────────
 # Health Check（供 UptimeRobot / Render ping 用）
 # ─────────────────────────────────────────────